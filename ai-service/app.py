@@ -3,7 +3,7 @@ Advanced AI Budget Prediction Service with Machine Learning
 
 This service uses sophisticated machine learning algorithms to analyze spending patterns
 and predict optimal budget allocations:
-- Linear Regression & Random Forest for trend prediction
+- Linear Regression & Gradient Boosting for trend prediction
 - K-Means Clustering for spending behavior classification
 - User Clustering for collaborative filtering recommendations
 - Seasonal Decomposition for pattern recognition
@@ -11,28 +11,42 @@ and predict optimal budget allocations:
 - Ensemble methods for robust predictions
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import Dict, List, Any, Optional, Tuple
+from pydantic_core import to_json
+from typing import Callable, Dict, List, Any, Mapping, Optional, Sequence, Tuple, Hashable
+from types import MappingProxyType
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 import os
 import logging
-from dataclasses import dataclass
+import math
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 import json
+import hashlib
+import hmac
+import tempfile
+import joblib
 
 # Machine Learning imports
 from sklearn.linear_model import LinearRegression, Ridge
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.cluster import KMeans
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.inspection import permutation_importance
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.metrics import mean_absolute_error, r2_score
 from sklearn.model_selection import train_test_split
-from scipy import stats
-from scipy.signal import find_peaks
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -67,7 +81,6 @@ class BudgetPredictionResponse(BaseModel):
     historical_spending_avg_dollars: float = 0.0  # Spending historical average
     trend_direction: str
     ml_model_used: str
-    feature_importance: Dict[str, float]
     spending_cluster: str
     seasonal_pattern: str
     reasoning: str
@@ -76,6 +89,7 @@ class ModelInfo(BaseModel):
     algorithms_used: List[str]
     features_analyzed: List[str]
     confidence_factors: List[str]
+    feature_importance: Dict[str, float] = {}  # The same for every prediction of a user, so sent once
 
 class PredictionResult(BaseModel):
     predictions: List[BudgetPredictionResponse]
@@ -95,13 +109,32 @@ class HealthResponse(BaseModel):
     status: str
     service: str
 
+def _replace_non_finite(value: Any) -> Any:
+    """Copy of a JSON-ready value with NaN and infinite floats replaced by None"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    return value
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded by pydantic-core's Rust serializer instead of the json module"""
+    
+    def render(self, content: Any) -> bytes:
+        # to_json writes NaN/Infinity as bare tokens, which are not valid JSON. They become null
+        # first, the same as in pydantic's model_dump_json used for /predict-budget.
+        return to_json(_replace_non_finite(content))
+
 # Initialize FastAPI app
 app = FastAPI(
     title="AI Budget Prediction Service",
     description="Advanced ML-based budget prediction service with feature engineering and ensemble methods",
     version="2.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=FastJSONResponse
 )
 
 # Add CORS middleware
@@ -113,114 +146,553 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class PreparedStatementConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements have been PREPAREd on it"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+# Parameter types of the prepared ML data queries ($1 = user id, $2 = cutoff date)
+FETCH_PARAM_TYPES = 'integer, timestamp'
+# Parameters of the peer recommendation statement: (months back, peer user ids, category ids)
+PEER_PARAM_TYPES = 'integer, bigint[], bigint[]'
+
+# Shared database connection pool, created on first use so the service can start before the database
+_connection_pool: Optional[ThreadedConnectionPool] = None
+_connection_pool_lock = threading.Lock()
+
+def get_connection_pool() -> ThreadedConnectionPool:
+    """Return the process-wide connection pool, creating it on first use"""
+    global _connection_pool
+    if _connection_pool is None:
+        with _connection_pool_lock:
+            if _connection_pool is None:
+                try:
+                    _connection_pool = ThreadedConnectionPool(
+                        minconn=int(os.getenv('DB_POOL_MIN', '2')),
+                        maxconn=int(os.getenv('DB_POOL_MAX', '16')),
+                        host=os.getenv('DB_HOST', 'postgres'),
+                        database=os.getenv('DB_NAME', 'finance_tracker'),
+                        user=os.getenv('DB_USER', 'finance_user'),
+                        password=os.getenv('DB_PASSWORD', 'finance_password'),
+                        port=os.getenv('DB_PORT', '5432'),
+                        connection_factory=PreparedStatementConnection
+                    )
+                except Exception as e:
+                    logger.error(f"Database connection failed: {e}")
+                    raise
+    return _connection_pool
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire a fixed number of seconds after being stored"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def discard_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop every entry whose key matches the predicate, returning how many were dropped"""
+        with self._lock:
+            stale_keys = [key for key in self._entries if predicate(key)]
+            for key in stale_keys:
+                del self._entries[key]
+            return len(stale_keys)
+
+# Daily per-user/category transaction totals shared by the peer clustering queries. The table
+# and its one-row state table (when it was rebuilt and from which transactions) are created by
+# the Go backend's AutoMigrate (models.MLUserSpendingDaily); this service rebuilds the totals in a
+# background task every SPENDING_SUMMARY_REFRESH seconds, and requests only ever read them.
+# Scheduled rebuilds skip the table while another worker holds the lock; forced ones wait for it
+SPENDING_SUMMARY_TRY_LOCK_SQL = "SELECT pg_try_advisory_xact_lock(hashtext('ml_user_spending_daily'))"
+SPENDING_SUMMARY_LOCK_SQL = "SELECT true FROM pg_advisory_xact_lock(hashtext('ml_user_spending_daily'))"
+# (rebuilt within the last %s seconds, current transactions fingerprint, unchanged since the rebuild)
+SPENDING_SUMMARY_STATE_SQL = """
+SELECT COALESCE(s.refreshed_at > now() - make_interval(secs => %s), false),
+       v.version,
+       COALESCE(s.source_version = v.version, false)
+FROM (SELECT concat_ws(',', COUNT(*), MAX(id), SUM(amount_cents), SUM(user_id), SUM(COALESCE(category_id, 0)),
+                       SUM(txn_date - DATE '2000-01-01')) AS version
+      FROM transactions) v
+LEFT JOIN ml_user_spending_daily_state s ON s.id = 1
+"""
+SPENDING_SUMMARY_STATE_UPDATE_SQL = """
+INSERT INTO ml_user_spending_daily_state (id, refreshed_at, source_version) VALUES (1, now(), %s)
+ON CONFLICT (id) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at, source_version = EXCLUDED.source_version
+"""
+SPENDING_SUMMARY_REFRESH_SQL = """
+DELETE FROM ml_user_spending_daily;
+INSERT INTO ml_user_spending_daily
+SELECT 
+    t.user_id,
+    t.category_id,
+    t.txn_date,
+    COUNT(*) FILTER (WHERE t.amount_cents < 0),
+    COALESCE(SUM(ABS(t.amount_cents)) FILTER (WHERE t.amount_cents < 0), 0),
+    COALESCE(SUM(t.amount_cents::numeric * t.amount_cents) FILTER (WHERE t.amount_cents < 0), 0),
+    COALESCE(SUM(t.amount_cents) FILTER (WHERE t.amount_cents > 0), 0),
+    COUNT(*)
+FROM transactions t
+GROUP BY t.user_id, t.category_id, t.txn_date;
+"""
+
+# Cheap fingerprint of every table the user profiles are built from (plus the date, which moves
+# the history windows). Transactions are only read through ml_user_spending_daily, so its rebuild
+# time stands in for them. Clusters are only rebuilt when one of these values changes.
+PEER_DATA_VERSION_SQL = """
+SELECT CURRENT_DATE, s.*, b.*, bi.*, u.*, a.*, c.*
+FROM (SELECT MAX(refreshed_at) FROM ml_user_spending_daily_state) s,
+     (SELECT COUNT(*), MAX(id), SUM(user_id), SUM(period_start::date - DATE '2000-01-01') FROM budgets) b,
+     (SELECT COUNT(*), MAX(id), SUM(planned_cents), SUM(COALESCE(category_id, 0)) FROM budget_items) bi,
+     (SELECT COUNT(*), MAX(id) FROM users) u,
+     (SELECT COUNT(*), MAX(id) FROM accounts) a,
+     (SELECT COUNT(*), MAX(id) FROM categories) c
+"""
+
+# A user's budget items with more features, shared by fetch_comprehensive_data and fetch_budget_history
+BUDGET_HISTORY_QUERY = """
+SELECT 
+    b.id as budget_id,
+    b.period_start,
+    b.period_end,
+    bi.category_id,
+    c.name as category_name,
+    c.kind as category_kind,
+    bi.planned_cents,
+    EXTRACT(MONTH FROM b.period_start)::int as month,
+    EXTRACT(YEAR FROM b.period_start)::int as year,
+    EXTRACT(DOW FROM b.period_start)::int as day_of_week,
+    EXTRACT(QUARTER FROM b.period_start)::int as quarter,
+    DATE_PART('epoch', b.period_start) as timestamp_epoch
+FROM budgets b
+JOIN budget_items bi ON b.id = bi.budget_id
+JOIN categories c ON bi.category_id = c.id
+WHERE b.user_id = $1 
+  AND b.period_start >= $2
+ORDER BY b.period_start DESC, c.name
+"""
+
+# Column types for the DataFrames built from the ML data queries (unlisted columns stay objects)
+BUDGET_DTYPES = {
+    'budget_id': 'int64', 'category_id': 'int64', 'planned_cents': 'int64',
+    'month': 'int64', 'year': 'int64', 'day_of_week': 'int64', 'quarter': 'int64', 'timestamp_epoch': 'float64'
+}
+SPENDING_DTYPES = {
+    'category_id': 'int64', 'spent_cents': 'int64', 'txn_count': 'int64',
+    'spent_deviation': 'float64', 'spent_squared_deviation': 'float64'
+}
+ACCOUNT_DTYPES = {
+    'account_id': 'int64', 'category_id': 'int64',
+    'transaction_count': 'int64', 'avg_transaction_amount': 'float64'
+}
+# Nullable columns (left joins, categories) are floats so missing values arrive as NaN
+PROFILE_DTYPES = {
+    'user_id': 'int64', 'category_id': 'float64', 'total_spent': 'float64',
+    'transaction_count': 'int64', 'avg_transaction': 'float64', 'spending_volatility': 'float64',
+    'avg_budget': 'float64', 'budget_count': 'float64'
+}
+USER_STATS_DTYPES = {
+    'user_id': 'int64', 'account_age_months': 'float64', 'account_count': 'int64',
+    'unique_categories': 'int64', 'total_expenses': 'float64', 'total_income': 'float64',
+    'active_months': 'int64'
+}
+
+# Seasonal features encode month and quarter as points on a circle, e.g. December sits next to January
+CYCLICAL_FEATURES = ['month_sin', 'month_cos', 'quarter_sin', 'quarter_cos']
+# sin/cos (rows) of every month and quarter position (columns), computed once at import
+MONTH_ENCODING = np.vstack([np.sin(2 * np.pi * np.arange(1, 13, dtype=float) / 12.0),
+                            np.cos(2 * np.pi * np.arange(1, 13, dtype=float) / 12.0)])
+QUARTER_ENCODING = np.vstack([np.sin(2 * np.pi * np.arange(1, 5, dtype=float) / 4.0),
+                              np.cos(2 * np.pi * np.arange(1, 5, dtype=float) / 4.0)])
+
+def cyclical_encoding(month, quarter) -> Dict[str, np.ndarray]:
+    """Sin/cos encode month and quarter (scalars or arrays) by table lookup"""
+    # Months and quarters are 1-based; out-of-range values wrap around the circle
+    month_sin, month_cos = MONTH_ENCODING[:, (np.asarray(month, dtype=int).ravel() - 1) % 12]
+    quarter_sin, quarter_cos = QUARTER_ENCODING[:, (np.asarray(quarter, dtype=int).ravel() - 1) % 4]
+    return dict(zip(CYCLICAL_FEATURES, (month_sin, month_cos, quarter_sin, quarter_cos)))
+
+# Array kernels for engineer_features. Rows arrive grouped into contiguous segments (one per
+# category); segment_start[i] is the index of the first row of row i's segment.
+
+def segment_cumsum(values: np.ndarray, segment_start: np.ndarray) -> np.ndarray:
+    """Running sum of values that restarts at the beginning of every segment"""
+    prefix = np.concatenate([[0.0], np.cumsum(values, dtype=float)])
+    return prefix[1:] - prefix[segment_start]
+
+def trend_slopes(values: np.ndarray, segment_start: np.ndarray, window: Optional[int] = None) -> np.ndarray:
+    """Least-squares slope of each row's expanding (or trailing window) values within its segment"""
+    # Slope against x = 0..n-1 over rows [lo, i], built from prefix sums of y and j*y so all
+    # windows are computed at once. Budget amounts are whole cents, so these sums are exact.
+    index = np.arange(len(values))
+    lo = segment_start if window is None else np.maximum(index + 1 - window, segment_start)
+    size = (index + 1 - lo).astype(float)
+    values = values.astype(float)
+    sum_prefix = np.concatenate([[0.0], np.cumsum(values)])
+    weighted_prefix = np.concatenate([[0.0], np.cumsum(index * values)])
+    sum_y = sum_prefix[index + 1] - sum_prefix[lo]
+    # Shift the window's x to start at 0, then centre it on its mean
+    sum_xy = weighted_prefix[index + 1] - weighted_prefix[lo] - lo * sum_y
+    covariance = sum_xy - (size - 1) / 2 * sum_y
+    variance = size * (size * size - 1) / 12
+    return np.divide(covariance, variance, out=np.zeros_like(covariance), where=size > 1)
+
+def period_accuracy(planned: np.ndarray, actual: np.ndarray, category_has_spending: np.ndarray) -> np.ndarray:
+    """How close each period's spending came to its budget (1 = exactly on budget)"""
+    # Periods without spending get 0.7 when the category has spending elsewhere, 0.5 otherwise
+    has_spending = actual > 0
+    largest = np.where(has_spending, np.maximum(planned, actual), 1.0)
+    return np.where(has_spending, 1.0 - np.abs(planned - actual) / largest,
+                    np.where(category_has_spending, 0.7, 0.5))
+
+# Model inputs, in the order the scaler and models are trained on
+FEATURE_COLUMNS = [
+    'month_sin', 'month_cos', 'quarter_sin', 'quarter_cos',
+    'historical_mean', 'historical_spent_mean', 'historical_std', 'historical_trend', 'historical_count',
+    'recent_mean', 'recent_trend', 'actual_spent', 'spending_frequency',
+    'avg_transaction_size', 'spending_volatility', 'budget_accuracy',
+    'account_diversity', 'primary_account_usage'
+]
+
+# Engineered columns that are only read through the float32 model matrices (or not read at all)
+# are stored as float32. Columns feeding the amount arithmetic, the trend labels or the spending
+# behavior clustering stay float64 so predictions and labels are unaffected.
+FLOAT32_FEATURES = {
+    'month_sin', 'month_cos', 'quarter_sin', 'quarter_cos', 'historical_std', 'historical_min', 'historical_max',
+    'recent_mean', 'recent_trend', 'historical_combined_mean', 'actual_spent', 'avg_transaction_size',
+    'account_diversity', 'primary_account_usage'
+}
+
+# Features copied from a category's latest row into its prediction row; historical_spent_mean is
+# not among them and stays 0
+PREDICTION_CARRIED_COLUMNS = [
+    'historical_mean', 'historical_std', 'historical_trend', 'historical_count',
+    'recent_mean', 'recent_trend', 'actual_spent', 'spending_frequency',
+    'avg_transaction_size', 'spending_volatility', 'budget_accuracy',
+    'account_diversity', 'primary_account_usage'
+]
+PREDICTION_CARRIED_POSITIONS = [FEATURE_COLUMNS.index(col) for col in PREDICTION_CARRIED_COLUMNS]
+
+# Value used for a missing (NaN) feature when building the training matrix
+FEATURE_FILL_DEFAULTS = {'month_cos': 1.0, 'quarter_cos': 1.0, 'budget_accuracy': 1.0,
+                         'account_diversity': 1.0, 'primary_account_usage': 1.0}
+FEATURE_FILL_VALUES = np.array([FEATURE_FILL_DEFAULTS.get(col, 0.0) for col in FEATURE_COLUMNS], dtype=np.float32)
+
+# Models trained on the raw feature matrix rather than the standardized one
+UNSCALED_MODELS = {'boosting'}
+
+# User populations at least this large are clustered with MiniBatchKMeans; below it a full
+# 10-restart KMeans takes only milliseconds and finds tighter clusters
+MINIBATCH_KMEANS_MIN_USERS = int(os.getenv('MINIBATCH_KMEANS_MIN_USERS', '1000'))
+
+# Cluster insight rules: (cluster profile field, ascending thresholds, message for each bucket from
+# lowest to highest). A value lands in bucket i when it is above i of the thresholds.
+INSIGHT_RULES = [
+    ('avg_budget_adherence', [0.6, 0.8], [
+        "You're in a group that tends to go over budget - consider more realistic planning",
+        "You're among users with good budget discipline, with room for improvement",
+        "You're in a group of highly disciplined budgeters who stick close to their plans",
+    ]),
+    ('avg_monthly_spending', [150000, 300000], [  # $1500 / $3000
+        "You're in a conservative-spending group - great for building savings",
+        "You're in a moderate-spending group with balanced financial habits",
+        "You're in a high-spending group - focus on identifying savings opportunities",
+    ]),
+    ('avg_categories', [5, 8], [
+        "Your group prefers simple budgeting with fewer categories",
+        "Your group maintains good spending visibility across key categories",
+        "Your group tracks spending across many categories - excellent for detailed budgeting",
+    ]),
+    ('avg_age_months', [12], [
+        "You're among newer users still developing their budgeting habits",
+        "You're grouped with experienced users who have established spending patterns",
+    ]),
+]
+
+
+def cluster_insights(cluster_profiles: List[Dict]) -> List[List[str]]:
+    """Pick the insight messages for a batch of cluster profiles in one pass per rule"""
+    buckets = []
+    for field, thresholds, _ in INSIGHT_RULES:
+        # NaN compares as "not above" every threshold, so it goes to the lowest bucket
+        values = np.nan_to_num(np.array([profile.get(field, 0) for profile in cluster_profiles], dtype=np.float64), nan=0.0)
+        # right=True puts values equal to a threshold in the lower bucket (strict "above")
+        buckets.append(np.digitize(values, thresholds, right=True))
+    return [
+        [messages[bucket[i]] for (_, _, messages), bucket in zip(INSIGHT_RULES, buckets)]
+        for i in range(len(cluster_profiles))
+    ]
+
+# Budget trends change by more than this many cents per period ($1) to count as increasing/decreasing
+TREND_SLOPE_THRESHOLD = 100
+TREND_DIRECTIONS = ("decreasing", "stable", "increasing")
+
+# ml_model_used label for each strategy returned by choose_prediction_strategies
+PREDICTION_STRATEGIES = {
+    'few_points': "Historical Average (only {data_points} data points)",
+    'low_accuracy': "Historical Average (very low accuracy)",
+    'accurate_budgeter': "Accurate Budgeter (spending ≈ budget)",
+    'peer_informed': "Peer-Informed Prediction ({peer_count} similar users)",
+    'peer_based': "Peer-Based Recommendation ({peer_count} similar users)",
+    'peer_insufficient': "Fallback Historical Average",
+    'neutral_extreme': "Conservative Historical (ML too extreme, neutral accuracy)",
+    'neutral_blend': "Conservative Ensemble (neutral accuracy)",
+    'spending_informed': "Spending-Informed Ensemble (spending > budget)",
+    'extreme': "Conservative Historical (ML too extreme)",
+    'confident': "Confident Ensemble (good accuracy)",
+    'stable': "Historical Average (stable pattern)",
+    'overspender': "Spending-Aware Ensemble (tend to overspend)",
+    'underspender': "Conservative Ensemble (good at budgeting)",
+    'balanced': "Balanced Ensemble (reasonable budgeter)",
+    'no_spending': "Conservative Ensemble (no spending history)",
+    'fallback': "Historical Average",
+}
+
+# Reasoning for each strategy: the opening reason, then the reasons added when the prediction is
+# more than 50 cents above or below the budget average (None when no adjustment is described).
+# Formatted with 'budget', 'predicted' and 'difference' in dollars.
+HISTORICAL_REASONING = ("Based on budget average ${budget:.2f}", None, None)
+ML_REASONING = ("Conservative ML prediction; budget average ${budget:.2f}",
+                "ML suggests +${difference:.2f} adjustment", "ML suggests ${difference:.2f} adjustment")
+REASONING_TEMPLATES = {
+    'few_points': HISTORICAL_REASONING,
+    'low_accuracy': HISTORICAL_REASONING,
+    'accurate_budgeter': ("Maintaining budget ${budget:.2f} (accurate budgeter)",
+                          "small +${difference:.2f} inflation buffer", "${difference:.2f} adjustment"),
+    # Peer-informed users have a budget history to compare against, peer-based ones do not
+    'peer_informed': ("Based on similar users: ${predicted:.2f}",
+                      "peers suggest +${difference:.2f} vs your history", "peers suggest ${difference:.2f} vs your history"),
+    'peer_based': ("Based on similar users: ${predicted:.2f}", None, None),
+    'peer_insufficient': HISTORICAL_REASONING,
+    'neutral_extreme': ML_REASONING,
+    'neutral_blend': ML_REASONING,
+    'spending_informed': ML_REASONING,
+    'extreme': ML_REASONING,
+    'confident': ML_REASONING,
+    'stable': ("Based on budget average ${budget:.2f} (stable pattern)", None, None),
+    'overspender': ML_REASONING,
+    'underspender': ML_REASONING,
+    'balanced': ML_REASONING,
+    'no_spending': ML_REASONING,
+    'fallback': HISTORICAL_REASONING,
+}
+
+
+def choose_prediction_strategies(budget_avg: np.ndarray, spending_avg: np.ndarray, ml_amount: np.ndarray,
+                                 model_agreement: np.ndarray, has_ml: np.ndarray, data_points: np.ndarray,
+                                 accuracy: np.ndarray, use_peers: np.ndarray, peer_budget: np.ndarray,
+                                 peer_samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Pick how to predict every category at once, returning (amounts, confidences, strategies)
+
+    Each argument holds one value per category and the budget average is the prediction baseline.
+    The strategies are checked in PREDICTION_STRATEGIES order and the first that applies wins; a
+    'fallback' category has a NaN amount and the caller uses its statistical fallback.
+    Confidences are not yet clamped to [0.1, 0.95].
+    """
+    historical_avg = budget_avg
+    max_reasonable_change = historical_avg * 0.5
+    ml_change = np.where(has_ml, np.abs(ml_amount - historical_avg), 0.0)
+    # Spending relative to budget; with no budget any spending counts as overspending
+    spending_ratio = np.divide(spending_avg, budget_avg, out=np.full(len(budget_avg), np.inf), where=budget_avg != 0)
+    has_spending = spending_avg > 0
+    
+    # Calculate base confidence based on data quality and spending history
+    base_confidence = np.minimum(0.9, 0.3 + (data_points * 0.08))  # More data = higher base confidence
+    
+    # Accuracy bonus/penalty: good (actual spending matches budgets well), poor (spending way off
+    # from budgets) or neutral (0.3-0.7, including 0.5 for no spending data)
+    accuracy_factor = np.select([accuracy > 0.7, accuracy < 0.3], [1.2, 0.8], default=1.0)
+    ml_confidence = base_confidence * accuracy_factor * model_agreement
+    
+    # PEER RECOMMENDATIONS: users with some history blend in similar users' budgets (more peers =
+    # higher weight), new users rely on them entirely
+    peer_confidence = np.minimum(0.8, 0.4 + (peer_samples * 0.05))  # Confidence based on peer sample size
+    peer_weight = np.minimum(0.6, peer_samples / 10)
+    enough_peers = use_peers & (peer_samples >= 3)
+    
+    good_accuracy = has_ml & (accuracy > 0.5)  # We have spending data that matches budgets
+    neutral_accuracy = has_ml & (accuracy == 0.5)  # Special case for neutral accuracy (no spending data)
+    
+    # (strategy, applies, amount, confidence), in priority order
+    ladder = [
+        # Pure historical average for insufficient data, with lower confidence
+        ('few_points', data_points < 3, historical_avg, base_confidence * 0.6),
+        ('low_accuracy', accuracy < 0.2, historical_avg, base_confidence * accuracy_factor * 0.7),
+        # Perfect budgeters (spending within 2% of budget) get a small 2% buffer for inflation
+        ('accurate_budgeter', has_ml & has_spending & (np.abs(spending_ratio - 1.0) < 0.02),
+         np.maximum(budget_avg, spending_avg * 1.02), ml_confidence * 0.92),
+        ('peer_informed', enough_peers & (historical_avg > 0),
+         historical_avg * (1 - peer_weight) + peer_budget * peer_weight, peer_confidence),
+        ('peer_based', enough_peers, peer_budget, peer_confidence),
+        ('peer_insufficient', use_peers, historical_avg, base_confidence * 0.6),
+        ('neutral_extreme', neutral_accuracy & (ml_change > max_reasonable_change),
+         historical_avg * 0.9 + ml_amount * 0.1, base_confidence * model_agreement * 0.7),
+        ('neutral_blend', neutral_accuracy, historical_avg * 0.8 + ml_amount * 0.2, base_confidence * model_agreement * 0.85),
+        # Spending consistently above budget: suggest closer to the spending amount (at least 95% of it)
+        ('spending_informed', good_accuracy & has_spending & (spending_avg > budget_avg * 1.05),
+         np.maximum(budget_avg, spending_avg * 0.95) * 0.7 + ml_amount * 0.3, ml_confidence * 0.85),
+        # ML prediction too extreme, use mostly historical average
+        ('extreme', good_accuracy & (ml_change > max_reasonable_change),
+         historical_avg * 0.95 + ml_amount * 0.05, ml_confidence * 0.85),
+        ('confident', good_accuracy, historical_avg * 0.6 + ml_amount * 0.4, ml_confidence * 0.85),
+        # Less than 2% change, just use historical average
+        ('stable', has_ml & (ml_change < historical_avg * 0.02), historical_avg, ml_confidence * 0.95),
+        # Consistent overspenders (5%+) get closer to spending, capped at 110% of it
+        ('overspender', has_ml & has_spending & (spending_ratio > 1.05),
+         np.minimum(ml_amount, spending_avg * 1.1), ml_confidence * 0.9),
+        # Consistent underspenders are good at budgeting, the ML prediction is probably reasonable
+        ('underspender', has_ml & has_spending & (spending_ratio < 0.95),
+         budget_avg * 0.7 + ml_amount * 0.3, ml_confidence * 0.9),
+        # Spending close to budget (95-105%); very accurate (98-102%) is handled above
+        ('balanced', has_ml & has_spending, spending_avg * 0.8 + ml_amount * 0.2, ml_confidence * 0.9),
+        # No spending history, conservative ML blend with budget baseline
+        ('no_spending', has_ml, budget_avg * 0.85 + ml_amount * 0.15, ml_confidence * 0.9),
+    ]
+    strategies, conditions, amounts, confidences = zip(*ladder)
+    
+    chosen = np.select(conditions, np.arange(len(ladder)), default=len(ladder))
+    predicted = np.select(conditions, amounts, default=np.nan)
+    confidence = np.select(conditions, confidences, default=base_confidence * 0.7)
+    return predicted, confidence, [(strategies + ('fallback',))[i] for i in chosen]
+
 @dataclass
-class MLBudgetPrediction:
-    category_id: int
-    category_name: str
-    predicted_amount_cents: int
-    confidence_score: float
-    historical_avg_cents: int  # Budget historical average
-    historical_spending_avg_cents: int  # Spending historical average  
-    trend_direction: str
-    ml_model_used: str
-    feature_importance: Dict[str, float]
-    spending_cluster: str
-    seasonal_pattern: str
-    reasoning: str
+class PredictionBatch:
+    """Predictions for a user's categories as parallel columns, one entry per category"""
+    category_ids: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    category_names: List[str] = field(default_factory=list)
+    predicted_amount_cents: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    confidence_scores: np.ndarray = field(default_factory=lambda: np.empty(0))
+    historical_avg_cents: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))  # Budget historical average
+    historical_spending_avg_cents: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))  # Spending historical average
+    trend_directions: List[str] = field(default_factory=list)
+    models_used: List[str] = field(default_factory=list)
+    spending_clusters: List[str] = field(default_factory=list)
+    seasonal_patterns: List[str] = field(default_factory=list)
+    reasons: List[str] = field(default_factory=list)
+    # Read-only view of the fitted models' importances, shared by every category
+    feature_importance: Mapping[str, float] = field(default_factory=lambda: MappingProxyType({}))
+    
+    def __len__(self) -> int:
+        return len(self.category_ids)
 
 class AdvancedBudgetPredictor:
     def __init__(self):
         self.db_connection = None
-        self.scaler = StandardScaler()
         self.models = {}
+        # Fitted models per user, reused while the user's training data is unchanged
+        self._model_cache = TTLCache(
+            maxsize=int(os.getenv('MODEL_CACHE_SIZE', '256')),
+            ttl=float(os.getenv('MODEL_CACHE_TTL', '3600'))
+        )
+        # Optional directory shared by all worker processes; models fitted by one worker are
+        # loaded by the others instead of being retrained
+        self.model_store_dir = os.getenv('MODEL_STORE_DIR', '')
         self.cluster_model = None
+        # User clusters per history window. Within CLUSTER_REFRESH seconds of the last check they
+        # are reused as they are; after that they are kept only if their input data is unchanged.
+        self.cluster_refresh_seconds = float(os.getenv('CLUSTER_REFRESH', '3600'))
+        self._cluster_cache = TTLCache(maxsize=8, ttl=24 * 3600)
+        # Query results per (user_id, months_back). /predict-budget, /analyze-patterns and
+        # /user-insights typically fetch the same user's history within moments of each other;
+        # the frames are only read downstream, so they are shared rather than copied.
+        self._data_cache = TTLCache(
+            maxsize=int(os.getenv('DATA_CACHE_SIZE', '256')),
+            ttl=float(os.getenv('DATA_CACHE_TTL', '60'))
+        )
         
+    @contextmanager
     def get_db_connection(self):
-        """Get database connection using environment variables"""
+        """Borrow a pooled database connection, returning it to the pool when done"""
+        pool = get_connection_pool()
+        connection = pool.getconn()
         try:
-            # Always create a fresh connection to avoid transaction issues
-            connection = psycopg2.connect(
-                host=os.getenv('DB_HOST', 'postgres'),
-                database=os.getenv('DB_NAME', 'finance_tracker'),
-                user=os.getenv('DB_USER', 'finance_user'),
-                password=os.getenv('DB_PASSWORD', 'finance_password'),
-                port=os.getenv('DB_PORT', '5432')
-            )
-            # Set autocommit to avoid transaction issues
-            connection.autocommit = True
-            return connection
-        except Exception as e:
-            logger.error(f"Database connection failed: {e}")
+            # Autocommit avoids leaving idle transactions open on pooled connections
+            if not connection.autocommit:
+                connection.autocommit = True
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Broken connections are dropped instead of being handed to the next request
+            pool.putconn(connection, close=True)
+            connection = None
             raise
+        finally:
+            if connection is not None:
+                pool.putconn(connection, close=bool(connection.closed))
     
     def fetch_comprehensive_data(self, user_id: int, months_back: int = 18) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
         """Fetch comprehensive financial data for ML analysis"""
         
-        # Enhanced budget query with more features
-        budget_query = """
-        SELECT 
-            b.id as budget_id,
-            b.period_start,
-            b.period_end,
-            bi.category_id,
-            c.name as category_name,
-            c.kind as category_kind,
-            bi.planned_cents,
-            EXTRACT(MONTH FROM b.period_start) as month,
-            EXTRACT(YEAR FROM b.period_start) as year,
-            EXTRACT(DOW FROM b.period_start) as day_of_week,
-            EXTRACT(QUARTER FROM b.period_start) as quarter,
-            DATE_PART('epoch', b.period_start) as timestamp_epoch
-        FROM budgets b
-        JOIN budget_items bi ON b.id = bi.budget_id
-        JOIN categories c ON bi.category_id = c.id
-        WHERE b.user_id = %s 
-          AND b.period_start >= %s
-        ORDER BY b.period_start DESC, c.name
-        """
+        cache_key = (user_id, months_back)
+        cached = self._data_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        # Enhanced spending query with transaction features
+        # Spending aggregated per category and day (transactions plus split lines). Budget periods
+        # are whole days, so daily totals are all feature engineering needs; deviations from the
+        # category's mean spend are summed as well so each period's spread can be rebuilt.
         spending_query = """
+        WITH spending AS (
+            SELECT 
+                t.category_id,
+                t.txn_date,
+                ABS(t.amount_cents) as spent_cents
+            FROM transactions t
+            JOIN categories c ON t.category_id = c.id
+            WHERE t.user_id = $1 
+              AND t.amount_cents < 0
+              AND t.txn_date >= $2
+            
+            UNION ALL
+            
+            SELECT 
+                ts.category_id,
+                t.txn_date,
+                ABS(ts.amount_cents) as spent_cents
+            FROM transaction_splits ts
+            JOIN transactions t ON ts.parent_txn_id = t.id
+            JOIN categories c ON ts.category_id = c.id
+            WHERE t.user_id = $1 
+              AND ts.amount_cents < 0
+              AND t.txn_date >= $2
+        ),
+        centered AS (
+            SELECT 
+                category_id,
+                txn_date,
+                spent_cents,
+                spent_cents - AVG(spent_cents) OVER (PARTITION BY category_id) as deviation
+            FROM spending
+        )
         SELECT 
-            t.category_id,
-            c.name as category_name,
-            c.kind as category_kind,
-            ABS(t.amount_cents) as spent_cents,
-            t.txn_date,
-            t.description,
-            EXTRACT(MONTH FROM t.txn_date) as month,
-            EXTRACT(YEAR FROM t.txn_date) as year,
-            EXTRACT(DOW FROM t.txn_date) as day_of_week,
-            EXTRACT(QUARTER FROM t.txn_date) as quarter,
-            EXTRACT(DAY FROM t.txn_date) as day_of_month,
-            DATE_PART('epoch', t.txn_date) as timestamp_epoch
-        FROM transactions t
-        JOIN categories c ON t.category_id = c.id
-        WHERE t.user_id = %s 
-          AND t.amount_cents < 0
-          AND t.txn_date >= %s
-        
-        UNION ALL
-        
-        SELECT 
-            ts.category_id,
-            c.name as category_name,
-            c.kind as category_kind,
-            ABS(ts.amount_cents) as spent_cents,
-            t.txn_date,
-            t.description,
-            EXTRACT(MONTH FROM t.txn_date) as month,
-            EXTRACT(YEAR FROM t.txn_date) as year,
-            EXTRACT(DOW FROM t.txn_date) as day_of_week,
-            EXTRACT(QUARTER FROM t.txn_date) as quarter,
-            EXTRACT(DAY FROM t.txn_date) as day_of_month,
-            DATE_PART('epoch', t.txn_date) as timestamp_epoch
-        FROM transaction_splits ts
-        JOIN transactions t ON ts.parent_txn_id = t.id
-        JOIN categories c ON ts.category_id = c.id
-        WHERE t.user_id = %s 
-          AND ts.amount_cents < 0
-          AND t.txn_date >= %s
+            category_id,
+            txn_date,
+            SUM(spent_cents)::bigint as spent_cents,
+            COUNT(*) as txn_count,
+            SUM(deviation)::float8 as spent_deviation,
+            SUM(deviation * deviation)::float8 as spent_squared_deviation
+        FROM centered
+        GROUP BY category_id, txn_date
         """
         
         # Account data for context
@@ -231,73 +703,73 @@ class AdvancedBudgetPredictor:
             a.type as account_type,
             t.category_id,
             COUNT(*) as transaction_count,
-            AVG(ABS(t.amount_cents)) as avg_transaction_amount
+            AVG(ABS(t.amount_cents))::float8 as avg_transaction_amount
         FROM accounts a
         JOIN transactions t ON a.id = t.account_id
         JOIN categories c ON t.category_id = c.id
-        WHERE a.user_id = %s 
+        WHERE a.user_id = $1 
           AND t.amount_cents < 0
-          AND t.txn_date >= %s
+          AND t.txn_date >= $2
         GROUP BY a.id, a.name, a.type, t.category_id
         """
         
         cutoff_date = datetime.now() - timedelta(days=months_back * 30)
         
-        conn = None
-        cursor = None
-        
         try:
-            conn = self.get_db_connection()
-            cursor = conn.cursor()
-            
-            # Fetch budgets
-            cursor.execute(budget_query, (user_id, cutoff_date))
-            budget_columns = [desc[0] for desc in cursor.description]
-            budget_data = cursor.fetchall()
-            budgets_df = pd.DataFrame(budget_data, columns=budget_columns)
-            
-            # Convert numeric columns to proper types
-            numeric_budget_cols = ['planned_cents', 'month', 'year', 'day_of_week', 'quarter', 'timestamp_epoch']
-            for col in numeric_budget_cols:
-                if col in budgets_df.columns:
-                    budgets_df[col] = pd.to_numeric(budgets_df[col], errors='coerce')
-            
-            # Fetch spending
-            cursor.execute(spending_query, (user_id, cutoff_date, user_id, cutoff_date))
-            spending_columns = [desc[0] for desc in cursor.description]
-            spending_data = cursor.fetchall()
-            spending_df = pd.DataFrame(spending_data, columns=spending_columns)
-            
-            # Convert numeric columns to proper types
-            numeric_spending_cols = ['spent_cents', 'month', 'year', 'day_of_week', 'quarter', 'day_of_month', 'timestamp_epoch']
-            for col in numeric_spending_cols:
-                if col in spending_df.columns:
-                    spending_df[col] = pd.to_numeric(spending_df[col], errors='coerce')
-            
-            # Fetch account data
-            cursor.execute(account_query, (user_id, cutoff_date))
-            account_columns = [desc[0] for desc in cursor.description]
-            account_data = cursor.fetchall()
-            accounts_df = pd.DataFrame(account_data, columns=account_columns)
-            
-            # Convert numeric columns to proper types
-            numeric_account_cols = ['transaction_count', 'avg_transaction_amount']
-            for col in numeric_account_cols:
-                if col in accounts_df.columns:
-                    accounts_df[col] = pd.to_numeric(accounts_df[col], errors='coerce')
+            with self.get_db_connection() as conn, conn.cursor() as cursor:
+                # All three result sets go through the same connection and cursor; numeric columns
+                # are typed while the DataFrames are built instead of converted column by column
+                params = (user_id, cutoff_date)
+                budgets_df = self._fetch_frame(cursor, 'ml_fetch_budgets', BUDGET_HISTORY_QUERY, params, BUDGET_DTYPES)
+                spending_df = self._fetch_frame(cursor, 'ml_fetch_spending', spending_query, params, SPENDING_DTYPES)
+                accounts_df = self._fetch_frame(cursor, 'ml_fetch_accounts', account_query, params, ACCOUNT_DTYPES)
             
+            # Failed queries are not cached so the next request retries them
+            self._data_cache.set(cache_key, (budgets_df, spending_df, accounts_df))
             return budgets_df, spending_df, accounts_df
             
         except Exception as e:
             logger.error(f"Database query failed: {e}")
             # Return empty DataFrames on error
             return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-        finally:
-            # Always close cursor and connection
-            if cursor:
-                cursor.close()
-            if conn:
-                conn.close()
+    
+    def fetch_budget_history(self, user_id: int, months_back: int = 18) -> pd.DataFrame:
+        """Fetch only the budget frame of fetch_comprehensive_data, reusing a cached full fetch if there is one"""
+        cached = self._data_cache.get((user_id, months_back))
+        if cached is not None:
+            return cached[0]
+        
+        cutoff_date = datetime.now() - timedelta(days=months_back * 30)
+        
+        try:
+            with self.get_db_connection() as conn, conn.cursor() as cursor:
+                return self._fetch_frame(cursor, 'ml_fetch_budgets', BUDGET_HISTORY_QUERY, (user_id, cutoff_date), BUDGET_DTYPES)
+        except Exception as e:
+            logger.error(f"Database query failed: {e}")
+            return pd.DataFrame()
+    
+    def _execute_prepared(self, cursor, name: str, param_types: str, query: str, params: Sequence) -> None:
+        """Execute a named server-side prepared statement, preparing it on first use"""
+        # The statement is parsed and planned once per pooled connection, later requests only EXECUTE it
+        connection = cursor.connection
+        if name not in connection.prepared_statements:
+            cursor.execute(f"PREPARE {name} ({param_types}) AS {query}")
+            connection.prepared_statements.add(name)
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    
+    def _fetch_frame(self, cursor, name: str, query: str, params: Tuple, dtypes: Dict[str, str],
+                     param_types: str = FETCH_PARAM_TYPES) -> pd.DataFrame:
+        """Run a prepared query (by default over (user_id, cutoff)) and build a typed DataFrame from its columns"""
+        self._execute_prepared(cursor, name, param_types, query, params)
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+        # Numeric columns are cast in SQL so psycopg2 hands back plain ints/floats, and each column
+        # goes straight into an array of its final dtype instead of an object frame that is
+        # converted afterwards
+        values = zip(*rows) if rows else [()] * len(columns)
+        return pd.DataFrame({
+            col: np.array(column, dtype=dtypes.get(col, object)) for col, column in zip(columns, values)
+        }, columns=columns, copy=False)
     
     def engineer_features(self, budgets_df: pd.DataFrame, spending_df: pd.DataFrame, accounts_df: pd.DataFrame) -> pd.DataFrame:
         """Engineer features for machine learning models"""
@@ -305,241 +777,343 @@ class AdvancedBudgetPredictor:
         if budgets_df.empty:
             return pd.DataFrame()
         
-        features_list = []
+        # Order rows category by category (in order of first appearance) and by date within each
+        # category, so every rolling/expanding window below only ever looks at earlier periods
+        df = budgets_df.copy()
+        df['category_order'] = pd.factorize(df['category_id'])[0]
+        df = df.sort_values(['category_order', 'period_start'], kind='mergesort').reset_index(drop=True)
+        df['planned_cents'] = df['planned_cents'].astype(float)
+        
+        by_category = df.groupby('category_order', sort=False)
+        planned = by_category['planned_cents']
+        
+        # Number of earlier periods for each row. Budgets sharing a period_start do not see each
+        # other, so every row in a tie takes the lookback of the first row of that tie.
+        position = by_category.cumcount().to_numpy()
+        segment_start = np.arange(len(df)) - position
+        tie_position = df.groupby(['category_order', 'period_start'], sort=False).cumcount()
+        historical_count = pd.Series(position, index=df.index) - tie_position
+        first_of_tie = np.arange(len(df)) - tie_position.to_numpy()
+        
+        def lookback(inclusive) -> pd.Series:
+            """Shift per-row running stats so each row only sees strictly earlier periods"""
+            shifted = np.concatenate([[np.nan], np.asarray(inclusive, dtype=float)[:-1]])
+            shifted[position == 0] = np.nan
+            return pd.Series(shifted[first_of_tie], index=df.index)
+        
+        def running(window) -> pd.Series:
+            """Drop the group level pandas adds to grouped rolling/expanding results"""
+            return window.reset_index(level=0, drop=True).sort_index()
+        
+        expanding = planned.expanding()
+        recent_window = planned.rolling(3, min_periods=1)
+        
+        # Budget-based historical stats (what was planned)
+        historical_mean = lookback(running(expanding.mean()))
+        historical_std = lookback(running(expanding.std()))
+        historical_min = lookback(running(expanding.min()))
+        historical_max = lookback(running(expanding.max()))
+        historical_trend = lookback(trend_slopes(df['planned_cents'].to_numpy(), segment_start))
+        
+        # Recent trend (last 3 periods)
+        recent_mean = lookback(running(recent_window.mean()))
+        recent_trend = lookback(trend_slopes(df['planned_cents'].to_numpy(), segment_start, window=3))
+        
+        # Spending inside each budget period [period_start, period_end] of the same category
+        if not spending_df.empty:
+            period_stats = self._period_spending_stats(df, spending_df)
+            categories_with_spending = spending_df.loc[spending_df['spent_cents'] > 0, 'category_id'].unique()
+        else:
+            period_stats = pd.DataFrame(np.nan, index=df.index, columns=['sum', 'count', 'mean', 'std'])
+            categories_with_spending = []
+        
+        period_count = period_stats['count'].fillna(0.0)
+        actual_spent = period_stats['sum'].fillna(0.0).astype(float)
+        
+        # Historical actual spending per past budget period (only periods that had spending count)
+        has_spending = period_count > 0
+        spent_sum = lookback(segment_cumsum(actual_spent.where(has_spending, 0.0).to_numpy(), segment_start))
+        spent_count = lookback(segment_cumsum(has_spending.to_numpy(), segment_start))
+        historical_spent_count = spent_count.fillna(0).astype(int)
+        historical_spent_mean = (spent_sum / spent_count.where(historical_spent_count > 0)).fillna(0.0)
+        
+        is_first = (historical_count == 0).to_numpy()
+        planned_cents = df['planned_cents'].to_numpy()
+        spent = actual_spent.to_numpy()
+        spent_count = historical_spent_count.to_numpy()
+        count = period_count.to_numpy()
+        
+        # Historical features (lookback) - first budget of a category uses its own amount as defaults
+        historical_mean = np.where(is_first, planned_cents, historical_mean.to_numpy())
+        historical_spent_mean = historical_spent_mean.to_numpy()
+        
+        # Combined historical mean: prefer actual spending mean when available
+        # Keep this for now but use budget mean as baseline for predictions
+        historical_combined_mean = np.where(
+            spent_count > 0,
+            0.7 * historical_spent_mean + 0.3 * historical_mean,
+            historical_mean
+        )
         
-        # Process each category
-        for category_id in budgets_df['category_id'].unique():
-            category_budgets = budgets_df[budgets_df['category_id'] == category_id].copy()
-            category_spending = spending_df[spending_df['category_id'] == category_id].copy() if not spending_df.empty else pd.DataFrame()
-            category_accounts = accounts_df[accounts_df['category_id'] == category_id].copy() if not accounts_df.empty else pd.DataFrame()
+        # Budget vs actual accuracy - if this period has spending, calculate accuracy.
+        # Categories with spending history outside this period get moderate accuracy (0.7);
+        # no spending data for the category at all stays neutral (0.5).
+        category_has_spending = df['category_id'].isin(categories_with_spending).to_numpy()
+        budget_accuracy = period_accuracy(planned_cents, spent, category_has_spending)
+        
+        # Account diversity features
+        if not accounts_df.empty:
+            account_stats = accounts_df.groupby('category_id')['transaction_count'].agg(['size', 'max'])
+            account_diversity = df['category_id'].map(account_stats['size']).fillna(1.0).to_numpy(dtype=float)
+            primary_account_usage = df['category_id'].map(account_stats['max']).fillna(1.0).to_numpy(dtype=float)
+        else:
+            account_diversity = np.ones(len(df))
+            primary_account_usage = np.ones(len(df))
+        
+        # Every column is a plain array of the same length, so the frame is assembled in one
+        # go without per-column index alignment or block insertions
+        columns = {
+            # Basic features
+            'category_id': df['category_id'].to_numpy(),
+            'category_name': df['category_name'].to_numpy(),
+            'target_amount': planned_cents,
+            'month': df['month'].to_numpy(dtype=int),
+            'quarter': df['quarter'].to_numpy(dtype=int),
+            'year': df['year'].to_numpy(dtype=int),
             
-            # Sort by date for time series features
-            category_budgets = category_budgets.sort_values('period_start')
+            # Cyclical encoding for seasonality
+            **cyclical_encoding(df['month'].to_numpy(), df['quarter'].to_numpy()),
             
-            for idx, budget_row in category_budgets.iterrows():
-                features = {}
-                
-                # Basic features
-                features['category_id'] = category_id
-                features['category_name'] = budget_row['category_name']
-                features['target_amount'] = float(budget_row['planned_cents'])
-                features['month'] = int(budget_row['month'])
-                features['quarter'] = int(budget_row['quarter'])
-                features['year'] = int(budget_row['year'])
-                
-                # Cyclical encoding for seasonality
-                features['month_sin'] = np.sin(2 * np.pi * float(budget_row['month']) / 12)
-                features['month_cos'] = np.cos(2 * np.pi * float(budget_row['month']) / 12)
-                features['quarter_sin'] = np.sin(2 * np.pi * float(budget_row['quarter']) / 4)
-                features['quarter_cos'] = np.cos(2 * np.pi * float(budget_row['quarter']) / 4)
-                
-                # Historical features (lookback)
-                period_start = budget_row['period_start']
-                historical_budgets = category_budgets[category_budgets['period_start'] < period_start]
-                
-                if len(historical_budgets) > 0:
-                    # Budget-based historical stats (what was planned)
-                    features['historical_mean'] = float(historical_budgets['planned_cents'].mean())
-                    features['historical_std'] = float(historical_budgets['planned_cents'].std())
-                    features['historical_min'] = float(historical_budgets['planned_cents'].min())
-                    features['historical_max'] = float(historical_budgets['planned_cents'].max())
-                    features['historical_trend'] = self._calculate_trend(historical_budgets['planned_cents'].values.astype(float))
-                    features['historical_count'] = len(historical_budgets)
-
-                    # Compute historical actual spending per past budget period (if any spending exists)
-                    # For each historical budget period, sum spending that falls within that period
-                    historical_spent_values = []
-                    for _, past_row in historical_budgets.iterrows():
-                        start = past_row['period_start']
-                        end = past_row['period_end']
-                        period_spent = category_spending[
-                            (category_spending['txn_date'] >= start) &
-                            (category_spending['txn_date'] <= end)
-                        ]
-                        if not period_spent.empty:
-                            historical_spent_values.append(float(period_spent['spent_cents'].sum()))
-
-                    if historical_spent_values:
-                        features['historical_spent_mean'] = float(np.mean(historical_spent_values))
-                        features['historical_spent_count'] = len(historical_spent_values)
-                    else:
-                        features['historical_spent_mean'] = 0.0
-                        features['historical_spent_count'] = 0
-
-                    # Combined historical mean: prefer actual spending mean when available
-                    # Keep this for now but use budget mean as baseline for predictions
-                    if features['historical_spent_count'] > 0:
-                        features['historical_combined_mean'] = float(
-                            0.7 * features['historical_spent_mean'] + 0.3 * features['historical_mean']
-                        )
-                    else:
-                        features['historical_combined_mean'] = float(features['historical_mean'])
-                    
-                    # Recent trend (last 3 periods)
-                    recent = historical_budgets.tail(3)
-                    features['recent_mean'] = float(recent['planned_cents'].mean()) if len(recent) > 0 else features['historical_mean']
-                    features['recent_trend'] = self._calculate_trend(recent['planned_cents'].values.astype(float)) if len(recent) > 1 else 0
-                else:
-                    # First budget - use defaults
-                    features['historical_mean'] = float(budget_row['planned_cents'])
-                    features['historical_std'] = 0.0
-                    features['historical_min'] = float(budget_row['planned_cents'])
-                    features['historical_max'] = float(budget_row['planned_cents'])
-                    features['historical_trend'] = 0.0
-                    features['historical_count'] = 0
-                    features['recent_mean'] = float(budget_row['planned_cents'])
-                    features['recent_trend'] = 0.0
-                    # No spending history yet
-                    features['historical_spent_mean'] = 0.0
-                    features['historical_spent_count'] = 0
-                    features['historical_combined_mean'] = float(budget_row['planned_cents'])
-                
-                # Spending pattern features
-                if not category_spending.empty:
-                    period_spending = category_spending[
-                        (category_spending['txn_date'] >= budget_row['period_start']) &
-                        (category_spending['txn_date'] <= budget_row['period_end'])
-                    ]
-                    
-                    features['actual_spent'] = float(period_spending['spent_cents'].sum()) if not period_spending.empty else 0.0
-                    features['spending_frequency'] = float(len(period_spending))
-                    features['avg_transaction_size'] = float(period_spending['spent_cents'].mean()) if not period_spending.empty else 0.0
-                    features['spending_volatility'] = float(period_spending['spent_cents'].std()) if len(period_spending) > 1 else 0.0
-                    
-                    # Calculate overall spending history for this category (not just this period)
-                    total_category_spending = float(category_spending['spent_cents'].sum())
-                    
-                    # Budget vs actual accuracy - if this period has spending, calculate accuracy
-                    if features['actual_spent'] > 0:
-                        planned_amount = float(budget_row['planned_cents'])
-                        features['budget_accuracy'] = 1.0 - abs(planned_amount - features['actual_spent']) / max(planned_amount, features['actual_spent'])
-                    elif total_category_spending > 0:
-                        # Category has spending history but not in this specific period
-                        # Give it moderate accuracy (better than neutral but not perfect)
-                        features['budget_accuracy'] = 0.7
-                    else:
-                        # No spending data for this category at all
-                        features['budget_accuracy'] = 0.5  # Neutral
-                else:
-                    # No spending records for this category across the entire fetched window
-                    features['actual_spent'] = 0.0
-                    features['spending_frequency'] = 0.0
-                    features['avg_transaction_size'] = 0.0
-                    features['spending_volatility'] = 0.0
-                    # Use neutral accuracy (0.5) so lack of data doesn't imply perfect matching
-                    features['budget_accuracy'] = 0.5
-                
-                # Account diversity features
-                if not category_accounts.empty:
-                    features['account_diversity'] = float(len(category_accounts))
-                    features['primary_account_usage'] = float(category_accounts['transaction_count'].max())
-                else:
-                    features['account_diversity'] = 1.0
-                    features['primary_account_usage'] = 1.0
-                
-                features_list.append(features)
+            # Historical features (lookback)
+            'historical_mean': historical_mean,
+            'historical_std': np.where(is_first, 0.0, historical_std.to_numpy()),
+            'historical_min': np.where(is_first, planned_cents, historical_min.to_numpy()),
+            'historical_max': np.where(is_first, planned_cents, historical_max.to_numpy()),
+            'historical_trend': np.where(is_first, 0.0, historical_trend.to_numpy()),
+            'historical_count': historical_count.to_numpy(),
+            'recent_mean': np.where(is_first, planned_cents, recent_mean.to_numpy()),
+            'recent_trend': np.where(is_first, 0.0, recent_trend.to_numpy()),
+            'historical_spent_mean': historical_spent_mean,
+            'historical_spent_count': spent_count,
+            'historical_combined_mean': historical_combined_mean,
+            
+            # Spending pattern features
+            'actual_spent': spent,
+            'spending_frequency': count.astype(float),
+            'avg_transaction_size': period_stats['mean'].fillna(0.0).to_numpy(dtype=float),
+            'spending_volatility': np.where(count > 1, period_stats['std'].to_numpy(dtype=float), 0.0),
+            'budget_accuracy': budget_accuracy,
+            'account_diversity': account_diversity,
+            'primary_account_usage': primary_account_usage,
+        }
+        features_df = pd.DataFrame({
+            name: np.asarray(values, dtype=np.float32) if name in FLOAT32_FEATURES else values
+            for name, values in columns.items()
+        }, index=df.index, copy=False)
         
-        return pd.DataFrame(features_list)
+        return features_df
+    
+    def _period_spending_stats(self, budgets_df: pd.DataFrame, spending_df: pd.DataFrame) -> pd.DataFrame:
+        """Sum, count, mean and std of the category's spending inside each budget period"""
+        # Sort the daily spending rows by (category, day) once; each budget period is then a
+        # contiguous slice found by binary search, and its stats come from prefix sums over that
+        # order. Overlapping or duplicate periods simply get overlapping slices.
+        codes, _ = pd.factorize(pd.concat([budgets_df['category_id'], spending_df['category_id']], ignore_index=True))
+        budget_codes, spending_codes = codes[:len(budgets_df)], codes[len(budgets_df):]
+        
+        def to_days(dates: pd.Series) -> np.ndarray:
+            return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(np.int64)
+        
+        txn_days = to_days(spending_df['txn_date'])
+        start_days, end_days = to_days(budgets_df['period_start']), to_days(budgets_df['period_end'])
+        first_day = min(txn_days.min(), start_days.min(), end_days.min())
+        day_span = max(txn_days.max(), start_days.max(), end_days.max()) - first_day + 1
+        
+        txn_keys = spending_codes * day_span + (txn_days - first_day)
+        order = np.argsort(txn_keys, kind='stable')
+        txn_keys = txn_keys[order]
+        
+        def prefix(column: str) -> np.ndarray:
+            return np.concatenate([[0.0], np.cumsum(spending_df[column].to_numpy(dtype=float)[order])])
+        
+        # Deviations are taken around each category's mean to keep the variance well conditioned
+        sum_prefix, count_prefix = prefix('spent_cents'), prefix('txn_count')
+        centered_prefix, square_prefix = prefix('spent_deviation'), prefix('spent_squared_deviation')
+        
+        lo = np.searchsorted(txn_keys, budget_codes * day_span + (start_days - first_day), side='left')
+        hi = np.searchsorted(txn_keys, budget_codes * day_span + (end_days - first_day), side='right')
+        hi = np.maximum(hi, lo)
+        count = count_prefix[hi] - count_prefix[lo]
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total = np.where(count > 0, sum_prefix[hi] - sum_prefix[lo], np.nan)
+            centered_total = centered_prefix[hi] - centered_prefix[lo]
+            variance = (square_prefix[hi] - square_prefix[lo] - centered_total * centered_total / count) / (count - 1)
+            std = np.where(count > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+            mean = total / count
+        
+        return pd.DataFrame({
+            'sum': total,
+            'count': np.where(count > 0, count, np.nan),
+            'mean': mean,
+            'std': std,
+        }, index=budgets_df.index)
     
     def _calculate_trend(self, values: np.ndarray) -> float:
         """Calculate trend slope for a series of values"""
-        if len(values) < 2:
+        n = len(values)
+        if n < 2:
             return 0.0
-        x = np.arange(len(values))
-        slope, _, _, _, _ = stats.linregress(x, values)
-        return float(slope)
+        # Least-squares slope against x = 0..n-1, whose mean and spread are known in closed form
+        x = np.arange(n) - (n - 1) / 2
+        return float(x @ (values - np.mean(values)) / (n * (n * n - 1) / 12))
     
-    def build_ml_models(self, features_df: pd.DataFrame) -> Dict[str, Any]:
+    def build_ml_models(self, features_df: pd.DataFrame, user_id: Optional[int] = None) -> Dict[str, Any]:
         """Build and train multiple ML models for budget prediction"""
         
         if features_df.empty or len(features_df) < 5:
             return {}
         
-        # Prepare features for ML
-        feature_columns = [
-            'month_sin', 'month_cos', 'quarter_sin', 'quarter_cos',
-            'historical_mean', 'historical_spent_mean', 'historical_std', 'historical_trend', 'historical_count',
-            'recent_mean', 'recent_trend', 'actual_spent', 'spending_frequency',
-            'avg_transaction_size', 'spending_volatility', 'budget_accuracy',
-            'account_diversity', 'primary_account_usage'
-        ]
-        
         # Fill any missing values
-        for col in feature_columns:
+        for col in FEATURE_COLUMNS:
             if col not in features_df.columns:
                 if col == 'historical_spent_mean':
                     features_df[col] = 0.0  # Default for spending mean
                 else:
                     features_df[col] = 0
         
-        # Clean the data and handle NaN values
-        X = features_df[feature_columns].copy()
-        
         # Use smarter target: if we have actual spending data, use the higher of budget or actual spending
         # This trains the model to predict what someone should budget based on their actual behavior
-        y = features_df.apply(lambda row: 
-            max(row['target_amount'], row['actual_spent']) if row['actual_spent'] > 0 
-            else row['target_amount'], axis=1)
-        
-        # Replace any remaining NaN values with appropriate defaults
-        X = X.fillna({
-            'month_sin': 0.0,
-            'month_cos': 1.0,
-            'quarter_sin': 0.0,
-            'quarter_cos': 1.0,
-            'historical_mean': 0.0,
-            'historical_std': 0.0,
-            'historical_trend': 0.0,
-            'historical_count': 0.0,
-            'recent_mean': 0.0,
-            'recent_trend': 0.0,
-            'actual_spent': 0.0,
-            'spending_frequency': 0.0,
-            'avg_transaction_size': 0.0,
-            'spending_volatility': 0.0,
-            'budget_accuracy': 1.0,
-            'account_diversity': 1.0,
-            'primary_account_usage': 1.0
-        })
-        
-        # Ensure all values are finite
-        X = X.replace([np.inf, -np.inf], 0.0)
-        y = y.fillna(0.0).replace([np.inf, -np.inf], 0.0)
-        
-        # Verify no NaN values remain
-        if X.isnull().any().any() or y.isnull().any():
-            logger.warning("NaN values still present after cleaning, filling with zeros")
-            X = X.fillna(0.0)
-            y = y.fillna(0.0)
-        
-        # Scale features
-        X_scaled = self.scaler.fit_transform(X)
+        target_amount = features_df['target_amount'].to_numpy(dtype=float)
+        actual_spent = features_df['actual_spent'].to_numpy(dtype=float)
+        y = np.where(actual_spent > 0, np.maximum(target_amount, actual_spent), target_amount)
+        y = np.nan_to_num(y, nan=0.0, posinf=0.0, neginf=0.0).astype(np.float32)
+        
+        # Clean the data in one pass over the matrix: NaN gets the column's default, +/-inf becomes 0.
+        # Cents, counts and sin/cos values need no more than float32, which halves the matrix size.
+        X = features_df[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+        X = np.where(np.isnan(X), FEATURE_FILL_VALUES, X)
+        X[np.isinf(X)] = 0.0
+        
+        # Refitting is pure CPU work, so skip it when this user's training data is unchanged
+        data_signature = hashlib.blake2b(
+            np.ascontiguousarray(X).tobytes() + np.ascontiguousarray(y).tobytes(),
+            digest_size=16
+        ).hexdigest()
+        if user_id is not None:
+            cached = self._model_cache.get(user_id)
+            if cached is not None and cached[0] == data_signature:
+                logger.info(f"Reusing ML models for user {user_id} trained on {len(X)} data points")
+                return cached[1]
+            stored = self._load_stored_models(user_id, data_signature)
+            if stored is not None:
+                logger.info(f"Loaded stored ML models for user {user_id} trained on {len(X)} data points")
+                self._model_cache.set(user_id, (data_signature, stored))
+                return stored
+        
+        # Each fit gets its own scaler so cached models keep the one they were trained with
+        scaler = StandardScaler(copy=False)
         
         models = {}
         
         # Only train if we have enough data
         if len(X) >= 5:
             try:
-                # Linear Regression with regularization
+                models['scaler'] = scaler
                 models['linear'] = Ridge(alpha=1.0)
-                models['linear'].fit(X_scaled, y)
+                # Histogram gradient boosting for non-linear patterns. The default min_samples_leaf (20)
+                # would stop most users' small histories from splitting at all. Early stopping stays
+                # 'auto' (only above 10k rows): its validation split would leave a few-row history
+                # with barely anything to fit on.
+                models['boosting'] = HistGradientBoostingRegressor(
+                    max_iter=100, max_depth=5, learning_rate=0.1, min_samples_leaf=5,
+                    early_stopping='auto', random_state=42
+                )
                 
-                # Random Forest for non-linear patterns
-                models['forest'] = RandomForestRegressor(n_estimators=50, random_state=42, max_depth=5)
-                models['forest'].fit(X_scaled, y)
+                # Trees only depend on the order of feature values, so the boosting model is fitted
+                # on the raw features before they are scaled in place for the linear model
+                models['boosting'].fit(X, y)
+                feature_importance = dict(zip(FEATURE_COLUMNS, self._boosting_feature_importance(models['boosting'], X, y)))
+                models['feature_importance'] = feature_importance
                 
-                # Store feature importance
-                if hasattr(models['forest'], 'feature_importances_'):
-                    feature_importance = dict(zip(feature_columns, models['forest'].feature_importances_))
-                    models['feature_importance'] = feature_importance
+                # Linear Regression with regularization
+                X_scaled = scaler.fit_transform(X)
+                models['linear'].fit(X_scaled, y)
                 
                 logger.info(f"Trained ML models on {len(X)} data points")
                 
+                if user_id is not None:
+                    self._model_cache.set(user_id, (data_signature, models))
+                    self._store_models(user_id, data_signature, models)
+                
             except Exception as e:
                 logger.warning(f"Failed to train ML models: {e}")
                 
         return models
     
+    def _load_stored_models(self, user_id: int, data_signature: str) -> Optional[Dict[str, Any]]:
+        """Load a user's stored models if they were fitted on the same training data"""
+        return self._load_from_store(f"models_{user_id}", data_signature)
+    
+    def _store_models(self, user_id: int, data_signature: str, models: Dict[str, Any]) -> None:
+        """Write a user's fitted models to the shared model store"""
+        self._save_to_store(f"models_{user_id}", data_signature, models)
+    
+    def _load_from_store(self, name: str, data_signature: str) -> Any:
+        """Load an object from the shared model store if it was built from the same data"""
+        if not self.model_store_dir:
+            return None
+        try:
+            # The file carries the signature of the data it was built from, so objects for
+            # changed data are simply ignored and overwritten by the next fit
+            stored_signature, value = joblib.load(os.path.join(self.model_store_dir, f"{name}.joblib"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not load {name} from the model store: {e}")
+            return None
+        return value if stored_signature == data_signature else None
+    
+    def _save_to_store(self, name: str, data_signature: str, value: Any) -> None:
+        """Write an object to the shared model store"""
+        if not self.model_store_dir:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(self.model_store_dir, exist_ok=True)
+            # Dump to a temporary file and rename it so other workers never read a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.model_store_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                joblib.dump((data_signature, value), f, compress=3)
+            os.replace(tmp_path, os.path.join(self.model_store_dir, f"{name}.joblib"))
+        except Exception as e:
+            logger.warning(f"Could not store {name} in the model store: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _boosting_feature_importance(self, model: HistGradientBoostingRegressor, X: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Normalized split-gain importance for a fitted gradient boosting model"""
+        # HistGradientBoostingRegressor has no feature_importances_; summing the split gains of its
+        # trees gives the same impurity-based measure the random forest reported, at no extra cost.
+        # The trees are private sklearn internals, so any change in their layout falls back to the
+        # public permutation importance, and to no importance at all if that fails too.
+        try:
+            gains = np.zeros(X.shape[1])
+            for iteration in model._predictors:
+                for tree in iteration:
+                    splits = tree.nodes[~tree.nodes['is_leaf'].astype(bool)]
+                    np.add.at(gains, splits['feature_idx'], splits['gain'])
+        except Exception as e:
+            logger.warning("Could not read split gains from the boosting model, using permutation importance: %s", e)
+            try:
+                gains = permutation_importance(model, X, y, n_repeats=5, random_state=42).importances_mean
+            except Exception as e:
+                logger.warning("Permutation importance failed, reporting zero feature importance: %s", e)
+                gains = np.zeros(X.shape[1])
+        gains = np.clip(gains, 0.0, None)
+        total = gains.sum()
+        return gains / total if total > 0 else gains
+    
     def classify_spending_behavior(self, features_df: pd.DataFrame) -> Dict[int, str]:
         """Use K-Means clustering to classify spending behaviors"""
         
@@ -566,12 +1140,11 @@ class AdvancedBudgetPredictor:
             
             # Map clusters to behavior types
             cluster_mapping = {0: "Conservative", 1: "Balanced", 2: "Volatile"}
+            behaviors = [cluster_mapping.get(cluster_id, "Balanced") for cluster_id in clusters.tolist()]
             
-            category_clusters = {}
-            for idx, row in features_df.iterrows():
-                category_id = row['category_id']
-                cluster_id = clusters[idx] if idx < len(clusters) else 0
-                category_clusters[category_id] = cluster_mapping.get(cluster_id, "Balanced")
+            # Labels line up with the feature rows; later rows overwrite earlier ones,
+            # so each category takes the label of its most recent budget period
+            category_clusters = dict(zip(features_df['category_id'].tolist(), behaviors))
             
             self.cluster_model = kmeans
             return category_clusters
@@ -583,65 +1156,164 @@ class AdvancedBudgetPredictor:
     def detect_seasonal_patterns(self, features_df: pd.DataFrame) -> Dict[int, str]:
         """Detect seasonal spending patterns using statistical analysis"""
         
-        patterns = {}
+        # One row per category with its mean budget for each calendar month, so every category
+        # is classified in the same array pass
+        monthly = features_df.groupby(['category_id', 'month'])['target_amount'].mean().unstack()
+        monthly = monthly.reindex(columns=range(1, 13))
+        budgets_per_category = features_df.groupby('category_id').size().reindex(monthly.index).to_numpy()
+        months_present = monthly.notna().sum(axis=1).to_numpy()
+        
+        # Coefficient of variation across the months that have budgets
+        monthly_mean = monthly.mean(axis=1).to_numpy()
+        monthly_std = monthly.std(axis=1).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cv = np.where(monthly_mean > 0, monthly_std / monthly_mean, 0.0)
+        
+        # Months without budgets sit at the category mean; peaks must also reach that mean
+        amounts = monthly.to_numpy()
+        amounts = np.where(np.isnan(amounts), monthly_mean[:, None], amounts)
+        peaks = self._monthly_peaks(amounts) & (amounts >= monthly_mean[:, None])
+        
+        labels = np.select(
+            [
+                budgets_per_category < 4,  # Need at least 4 data points
+                months_present < 3,
+                cv <= 0.3,
+                peaks[:, [10, 11, 0]].any(axis=1),  # Nov, Dec, Jan
+                peaks[:, [5, 6, 7]].any(axis=1),  # Jun, Jul, Aug
+                peaks.any(axis=1),
+            ],
+            ["Insufficient data", "Limited data", "Stable", "Holiday seasonal", "Summer seasonal", "Irregular seasonal"],
+            default="Stable"
+        )
         
-        for category_id in features_df['category_id'].unique():
-            category_data = features_df[features_df['category_id'] == category_id]
-            
-            if len(category_data) < 4:  # Need at least 4 data points
-                patterns[category_id] = "Insufficient data"
-                continue
-            
-            # Analyze monthly patterns
-            monthly_amounts = category_data.groupby('month')['target_amount'].mean()
-            
-            if len(monthly_amounts) >= 3:
-                # Calculate coefficient of variation
-                cv = monthly_amounts.std() / monthly_amounts.mean() if monthly_amounts.mean() > 0 else 0
-                
-                if cv > 0.3:
-                    # Find peaks and troughs
-                    amounts_array = monthly_amounts.reindex(range(1, 13), fill_value=monthly_amounts.mean()).values
-                    peaks, _ = find_peaks(amounts_array, height=monthly_amounts.mean())
-                    
-                    if len(peaks) > 0:
-                        peak_months = peaks + 1  # Convert to 1-based months
-                        if any(month in [11, 12, 1] for month in peak_months):
-                            patterns[category_id] = "Holiday seasonal"
-                        elif any(month in [6, 7, 8] for month in peak_months):
-                            patterns[category_id] = "Summer seasonal"
-                        else:
-                            patterns[category_id] = "Irregular seasonal"
-                    else:
-                        patterns[category_id] = "Stable"
-                else:
-                    patterns[category_id] = "Stable"
-            else:
-                patterns[category_id] = "Limited data"
+        # Plain ints as keys: the result goes straight into the /analyze-patterns JSON response
+        category_ids = features_df['category_id'].unique().tolist()
+        return dict(zip(category_ids, pd.Series(labels, index=monthly.index).reindex(category_ids).tolist()))
+    
+    def _monthly_peaks(self, amounts: np.ndarray) -> np.ndarray:
+        """Mark local maxima in each row of month amounts (same rules as scipy's find_peaks)"""
+        # A peak is a run of equal values with lower neighbours on both sides, reported at the
+        # middle of the run; the first and last month can never be peaks
+        n_rows, n_months = amounts.shape
+        positions = np.broadcast_to(np.arange(n_months), amounts.shape)
+        changes = amounts[:, 1:] != amounts[:, :-1]
+        
+        run_start = np.maximum.accumulate(
+            np.where(np.hstack([np.ones((n_rows, 1), dtype=bool), changes]), positions, 0), axis=1
+        )
+        run_end = np.minimum.accumulate(
+            np.where(np.hstack([changes, np.ones((n_rows, 1), dtype=bool)]), positions, n_months - 1)[:, ::-1], axis=1
+        )[:, ::-1]
+        
+        inside = (run_start > 0) & (run_end < n_months - 1)
+        rows = np.arange(n_rows)[:, None]
+        left = amounts[rows, np.maximum(run_start - 1, 0)]
+        right = amounts[rows, np.minimum(run_end + 1, n_months - 1)]
+        return inside & (left < amounts) & (right < amounts) & (positions == (run_start + run_end) // 2)
+    
+    def refresh_spending_summary(self, force: bool = False) -> bool:
+        """Rebuild ml_user_spending_daily if it is stale and transactions changed, returning False on errors"""
+        max_age = float(os.getenv('SPENDING_SUMMARY_REFRESH', '3600'))
+        rebuilt = False
+        try:
+            with self.get_db_connection() as conn:
+                # Rebuild inside one transaction so readers keep seeing the previous totals until it
+                # commits. The advisory lock and the state row are shared by all worker processes,
+                # so only one of them rebuilds per interval and only when transactions changed.
+                conn.autocommit = False
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(SPENDING_SUMMARY_LOCK_SQL if force else SPENDING_SUMMARY_TRY_LOCK_SQL)
+                        if cursor.fetchone()[0]:
+                            cursor.execute(SPENDING_SUMMARY_STATE_SQL, (max_age,))
+                            fresh, source_version, unchanged = cursor.fetchone()
+                            if force or not (fresh or unchanged):
+                                cursor.execute(SPENDING_SUMMARY_REFRESH_SQL)
+                                cursor.execute(SPENDING_SUMMARY_STATE_UPDATE_SQL, (source_version,))
+                                rebuilt = True
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+        except Exception as e:
+            logger.error(f"Error refreshing spending summary: {e}")
+            return False
+        if rebuilt:
+            logger.info("Refreshed ml_user_spending_daily")
+        return True
+    
+    def get_user_clusters(self, historical_months: int = 18, force: bool = False) -> Dict[int, Dict]:
+        """Cluster all users' profiles, reusing the last clustering while its input data is unchanged"""
+        
+        # Clusters describe the whole user base and drift slowly, so single predictions do not
+        # even check for changes more than once per refresh interval
+        cached = self._cluster_cache.get(historical_months)
+        if not force and cached is not None and time.monotonic() - cached[2] < self.cluster_refresh_seconds:
+            return cached[1]
         
-        return patterns
+        if force:
+            self.refresh_spending_summary(force=True)
+        try:
+            with self.get_db_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(PEER_DATA_VERSION_SQL)
+                data_version = tuple(cursor.fetchone())
+        except Exception as e:
+            logger.warning(f"Could not read peer data version: {e}")
+            # Without a version the refresh interval still throttles rebuilds: the last clusters
+            # are kept, or fresh ones are stored under an unknown version (which never matches)
+            if not force and cached is not None:
+                clusters = cached[1]
+            else:
+                clusters = self._build_user_clusters(historical_months)
+            self._cluster_cache.set(historical_months, ((historical_months, None), clusters, time.monotonic()))
+            return clusters
+        
+        cache_key = (historical_months, data_version)
+        if not force and cached is not None and cached[0] == cache_key:
+            self._cluster_cache.set(historical_months, (cache_key, cached[1], time.monotonic()))
+            return cached[1]
+        
+        data_signature = hashlib.blake2b(repr((historical_months, data_version)).encode(), digest_size=16).hexdigest()
+        clusters = None if force else self._load_from_store(f"user_clusters_{historical_months}", data_signature)
+        if clusters is None:
+            clusters = self._build_user_clusters(historical_months)
+            if clusters:
+                self._save_to_store(f"user_clusters_{historical_months}", data_signature, clusters)
+        self._cluster_cache.set(historical_months, (cache_key, clusters, time.monotonic()))
+        return clusters
+    
+    def _build_user_clusters(self, historical_months: int) -> Dict[int, Dict]:
+        """Fetch the per-category profiles and per-user stats and cluster them"""
+        return self.cluster_users(self.create_user_profiles(historical_months), self.create_user_stats(historical_months))
     
     def create_user_profiles(self, historical_months: int = 18) -> pd.DataFrame:
-        """Create user spending profiles for clustering"""
+        """Create per-category user spending profiles for clustering"""
         
         try:
             # Get all users' spending data
             query = """
             WITH user_spending AS (
+                -- Expense count, sum and sum of squares per day give the same mean and
+                -- sample standard deviation as aggregating the transactions themselves
                 SELECT 
                     u.id as user_id,
                     u.created_at as user_since,
                     COALESCE(cat.name, 'Uncategorized') as category,
                     cat.id as category_id,
-                    SUM(ABS(t.amount_cents)) as total_spent,
-                    COUNT(t.id) as transaction_count,
-                    AVG(ABS(t.amount_cents)) as avg_transaction,
-                    STDDEV(ABS(t.amount_cents)) as spending_volatility
+                    SUM(d.expense_cents)::float8 as total_spent,
+                    SUM(d.expense_count)::bigint as transaction_count,
+                    (SUM(d.expense_cents) / SUM(d.expense_count))::float8 as avg_transaction,
+                    CASE WHEN SUM(d.expense_count) > 1 THEN SQRT(GREATEST(
+                        (SUM(d.expense_squares) - SUM(d.expense_cents) ^ 2 / SUM(d.expense_count)) / (SUM(d.expense_count) - 1), 0
+                    ))::float8 END as spending_volatility
                 FROM users u
-                LEFT JOIN transactions t ON u.id = t.user_id 
-                LEFT JOIN categories cat ON t.category_id = cat.id
-                WHERE t.txn_date >= CURRENT_DATE - INTERVAL '%s months'
-                    AND t.amount_cents < 0  -- Only expenses
+                JOIN ml_user_spending_daily d ON u.id = d.user_id
+                LEFT JOIN categories cat ON d.category_id = cat.id
+                WHERE d.txn_date >= CURRENT_DATE - make_interval(months => $1)
+                    AND d.expense_count > 0  -- Only expenses
                 GROUP BY u.id, u.created_at, cat.id, cat.name
             ),
             user_budgets AS (
@@ -649,102 +1321,109 @@ class AdvancedBudgetPredictor:
                     u.id as user_id,
                     COALESCE(cat.name, 'Uncategorized') as category,
                     cat.id as category_id,
-                    AVG(bi.planned_cents) as avg_budget,
+                    AVG(bi.planned_cents)::float8 as avg_budget,
                     COUNT(bi.id) as budget_count
                 FROM users u
                 LEFT JOIN budgets b ON u.id = b.user_id
                 LEFT JOIN budget_items bi ON b.id = bi.budget_id
                 LEFT JOIN categories cat ON bi.category_id = cat.id
-                WHERE b.period_start >= CURRENT_DATE - INTERVAL '%s months'
+                WHERE b.period_start >= CURRENT_DATE - make_interval(months => $1)
                 GROUP BY u.id, cat.id, cat.name
-            ),
-            user_stats AS (
-                SELECT 
-                    u.id as user_id,
-                    EXTRACT(DAYS FROM CURRENT_DATE - u.created_at) / 30.0 as account_age_months,
-                    COUNT(DISTINCT acc.id) as account_count,
-                    COUNT(DISTINCT t.category_id) as unique_categories,
-                    SUM(CASE WHEN t.amount_cents < 0 THEN ABS(t.amount_cents) ELSE 0 END) as total_expenses,
-                    SUM(CASE WHEN t.amount_cents > 0 THEN t.amount_cents ELSE 0 END) as total_income,
-                    COUNT(DISTINCT DATE_TRUNC('month', t.txn_date)) as active_months
-                FROM users u
-                LEFT JOIN accounts acc ON u.id = acc.user_id
-                LEFT JOIN transactions t ON u.id = t.user_id
-                WHERE t.txn_date >= CURRENT_DATE - INTERVAL '%s months'
-                GROUP BY u.id, u.created_at
             )
             SELECT 
                 us.*,
                 ub.avg_budget,
-                ub.budget_count,
-                ustat.account_age_months,
-                ustat.account_count,
-                ustat.unique_categories,
-                ustat.total_expenses,
-                ustat.total_income,
-                ustat.active_months
+                ub.budget_count
             FROM user_spending us
             LEFT JOIN user_budgets ub ON us.user_id = ub.user_id AND us.category_id = ub.category_id
-            LEFT JOIN user_stats ustat ON us.user_id = ustat.user_id
             WHERE us.total_spent > 0
             ORDER BY us.user_id, us.category
             """
             
-            conn = psycopg2.connect(
-                host=os.getenv('DB_HOST', 'postgres'),
-                database=os.getenv('DB_NAME', 'finance_tracker'),
-                user=os.getenv('DB_USER', 'finance_user'),
-                password=os.getenv('DB_PASSWORD', 'finance_password'),
-                port=os.getenv('DB_PORT', '5432')
-            )
-            df = pd.read_sql(query, conn, params=[historical_months, historical_months, historical_months])
-            conn.close()
-            
-            return df
+            # Numeric columns are cast to float8 in SQL and each column goes straight into a typed
+            # array, rather than pandas converting every cell of an object frame
+            with self.get_db_connection() as conn, conn.cursor() as cursor:
+                return self._fetch_frame(cursor, 'ml_user_profiles', query, (int(historical_months),), PROFILE_DTYPES, 'integer')
             
         except Exception as e:
             logger.error(f"Error creating user profiles: {e}")
             return pd.DataFrame()
     
-    def cluster_users(self, user_profiles_df: pd.DataFrame, n_clusters: int = 5) -> Dict[int, Dict]:
+    def create_user_stats(self, historical_months: int = 18) -> pd.DataFrame:
+        """Per-user account and income/expense stats for clustering, one row per user"""
+        
+        try:
+            # Accounts are counted in their own subquery: joining them to the transactions would
+            # repeat every transaction once per account and inflate the expense and income totals
+            query = """
+            SELECT 
+                u.id as user_id,
+                (EXTRACT(DAYS FROM CURRENT_DATE - u.created_at) / 30.0)::float8 as account_age_months,
+                COALESCE(MAX(acc.account_count), 0) as account_count,
+                COUNT(DISTINCT d.category_id) as unique_categories,
+                SUM(d.expense_cents)::float8 as total_expenses,
+                SUM(d.income_cents)::float8 as total_income,
+                COUNT(DISTINCT DATE_TRUNC('month', d.txn_date)) as active_months
+            FROM users u
+            JOIN ml_user_spending_daily d ON u.id = d.user_id
+            LEFT JOIN (
+                SELECT user_id, COUNT(*) as account_count FROM accounts GROUP BY user_id
+            ) acc ON u.id = acc.user_id
+            WHERE d.txn_date >= CURRENT_DATE - make_interval(months => $1)
+            GROUP BY u.id, u.created_at
+            ORDER BY u.id
+            """
+            
+            with self.get_db_connection() as conn, conn.cursor() as cursor:
+                stats = self._fetch_frame(cursor, 'ml_user_stats', query, (int(historical_months),), USER_STATS_DTYPES, 'integer')
+            return stats.set_index('user_id')
+            
+        except Exception as e:
+            logger.error(f"Error creating user stats: {e}")
+            return pd.DataFrame()
+    
+    def cluster_users(self, user_profiles_df: pd.DataFrame, user_stats_df: pd.DataFrame, n_clusters: int = 5) -> Dict[int, Dict]:
         """Cluster users based on spending patterns and demographics"""
         
         if user_profiles_df.empty:
             return {}
         
         try:
-            # Create user-level aggregated features
-            user_features = user_profiles_df.groupby('user_id').agg({
+            # Create user-level aggregated features: the per-category profiles are aggregated per
+            # user and joined to the per-user stats
+            per_user_agg = user_profiles_df.groupby('user_id').agg({
                 'total_spent': 'sum',
                 'transaction_count': 'sum', 
                 'avg_transaction': 'mean',
                 'spending_volatility': 'mean',
                 'avg_budget': 'mean',
-                'budget_count': 'sum',
-                'account_age_months': 'first',
-                'account_count': 'first',
-                'unique_categories': 'first',
-                'total_expenses': 'first',
-                'total_income': 'first',
-                'active_months': 'first'
-            }).fillna(0)
-            
-            # Calculate additional features
-            user_features['expense_to_income_ratio'] = np.where(
-                user_features['total_income'] > 0,
-                user_features['total_expenses'] / user_features['total_income'],
-                1.0
+                'budget_count': 'sum'
+            })
+            user_features = per_user_agg.join(user_stats_df.reindex(columns=list(USER_STATS_DTYPES)[1:]))
+            # Replace missing values in one pass over a single float block instead of column by column
+            user_features = pd.DataFrame(
+                np.nan_to_num(user_features.to_numpy(dtype=np.float64), copy=False, nan=0.0),
+                index=user_features.index, columns=user_features.columns
             )
-            user_features['avg_monthly_spending'] = np.where(
-                user_features['active_months'] > 0,
-                user_features['total_expenses'] / user_features['active_months'],
-                0
+            
+            # Calculate additional features. Each ratio is divided straight into an array that
+            # already holds its default, only where the denominator is positive
+            total_expenses = user_features['total_expenses'].to_numpy(dtype=np.float64)
+            total_income = user_features['total_income'].to_numpy(dtype=np.float64)
+            active_months = user_features['active_months'].to_numpy(dtype=np.float64)
+            avg_budget = user_features['avg_budget'].to_numpy(dtype=np.float64)
+            
+            user_features['expense_to_income_ratio'] = np.divide(
+                total_expenses, total_income, out=np.ones(len(user_features)), where=total_income > 0
             )
-            user_features['budget_adherence'] = np.where(
-                user_features['avg_budget'] > 0,
-                1 - abs(user_features['total_expenses'] - user_features['avg_budget']) / user_features['avg_budget'],
-                0.5
+            user_features['avg_monthly_spending'] = np.divide(
+                total_expenses, active_months, out=np.zeros(len(user_features)), where=active_months > 0
             )
+            has_budget = avg_budget > 0
+            budget_adherence = np.full(len(user_features), 0.5)
+            np.divide(np.abs(total_expenses - avg_budget), avg_budget, out=budget_adherence, where=has_budget)
+            np.subtract(1.0, budget_adherence, out=budget_adherence, where=has_budget)
+            user_features['budget_adherence'] = budget_adherence
             
             # Select features for clustering
             clustering_features = [
@@ -752,7 +1431,9 @@ class AdvancedBudgetPredictor:
                 'spending_volatility', 'unique_categories', 'account_age_months'
             ]
             
-            feature_data = user_features[clustering_features].fillna(0)
+            # float32 halves the bytes every KMeans distance pass has to read (the derived ratios
+            # are NaN-free by construction, so no second NaN pass is needed)
+            feature_data = user_features[clustering_features].to_numpy(dtype=np.float32)
             
             # Adaptive cluster count: use fewer clusters if we don't have enough users
             n_users = len(user_features)
@@ -765,12 +1446,20 @@ class AdvancedBudgetPredictor:
             effective_clusters = min(n_clusters, max(2, n_users // 2))  # At least 2, at most n_users//2
             logger.info(f"Clustering {n_users} users into {effective_clusters} clusters")
             
-            # Normalize features
-            scaler = StandardScaler()
-            normalized_features = scaler.fit_transform(feature_data)
+            # Standardize features in place (feature_data is a fresh array); statistics are
+            # accumulated in float64 and constant columns are left unscaled, as StandardScaler does
+            feature_mean = feature_data.mean(axis=0, dtype=np.float64)
+            feature_std = feature_data.std(axis=0, dtype=np.float64)
+            feature_std[feature_std == 0] = 1.0
+            normalized_features = feature_data
+            normalized_features -= feature_mean.astype(np.float32)
+            normalized_features /= feature_std.astype(np.float32)
             
             # Perform clustering
-            kmeans = KMeans(n_clusters=effective_clusters, random_state=42, n_init=10)
+            if n_users >= MINIBATCH_KMEANS_MIN_USERS:
+                kmeans = MiniBatchKMeans(n_clusters=effective_clusters, random_state=42, n_init=3, batch_size=256)
+            else:
+                kmeans = KMeans(n_clusters=effective_clusters, random_state=42, n_init=10)
             user_features['cluster'] = kmeans.fit_predict(normalized_features)
             
             # Create cluster profiles
@@ -787,18 +1476,21 @@ class AdvancedBudgetPredictor:
                     'user_ids': cluster_users.index.tolist()
                 }
                 clusters[cluster_id] = cluster_profile
+            
+            for cluster_profile, insights in zip(clusters.values(), cluster_insights(list(clusters.values()))):
+                cluster_profile['insights'] = insights
                 
-            # Return user cluster assignments with profiles
-            user_clusters = {}
-            for user_id in user_features.index:
-                cluster_id = user_features.loc[user_id, 'cluster']
-                user_clusters[user_id] = {
+            # Return user cluster assignments with profiles. A user's peers are the first members of
+            # their cluster other than themselves, so only the first 11 members are ever needed.
+            peer_candidates = {cluster_id: profile['user_ids'][:11] for cluster_id, profile in clusters.items()}
+            return {
+                user_id: {
                     'cluster_id': cluster_id,
                     'cluster_profile': clusters[cluster_id],
-                    'similarity_peers': [uid for uid in clusters[cluster_id]['user_ids'] if uid != user_id][:10]  # Top 10 similar users
+                    'similarity_peers': [uid for uid in peer_candidates[cluster_id] if uid != user_id][:10]  # Top 10 similar users
                 }
-                
-            return user_clusters
+                for user_id, cluster_id in zip(user_features.index.tolist(), user_features['cluster'].tolist())
+            }
             
         except Exception as e:
             logger.error(f"Error clustering users: {e}")
@@ -807,7 +1499,13 @@ class AdvancedBudgetPredictor:
     def get_peer_recommendations(self, user_id: int, target_category_id: int, user_clusters: Dict, historical_months: int = 6) -> Dict:
         """Get budget recommendations based on similar users"""
         
-        if user_id not in user_clusters:
+        peer_stats = self.get_peer_recommendations_bulk(user_id, [target_category_id], user_clusters, historical_months)
+        return peer_stats.get(int(target_category_id), {})
+    
+    def get_peer_recommendations_bulk(self, user_id: int, category_ids: List[int], user_clusters: Dict, historical_months: int = 6) -> Dict[int, Dict]:
+        """Get peer budget recommendations for several categories in one query, keyed by category_id"""
+        
+        if user_id not in user_clusters or len(category_ids) == 0:
             return {}
         
         try:
@@ -816,8 +1514,6 @@ class AdvancedBudgetPredictor:
                 return {}
             
             # Get successful budget patterns from similar users
-            similar_users_str = ','.join(map(str, similar_users))
-            
             query = """
             WITH peer_budgets AS (
                 SELECT 
@@ -829,22 +1525,23 @@ class AdvancedBudgetPredictor:
                 JOIN budgets b ON bi.budget_id = b.id
                 LEFT JOIN (
                     SELECT 
-                        t.user_id,
-                        t.category_id,
-                        DATE_TRUNC('month', t.txn_date) as month,
-                        SUM(ABS(t.amount_cents)) as total_spent
-                    FROM transactions t
-                    WHERE t.amount_cents < 0
-                        AND t.txn_date >= CURRENT_DATE - INTERVAL '%s months'
-                    GROUP BY t.user_id, t.category_id, DATE_TRUNC('month', t.txn_date)
+                        d.user_id,
+                        d.category_id,
+                        DATE_TRUNC('month', d.txn_date) as month,
+                        SUM(d.expense_cents) as total_spent
+                    FROM ml_user_spending_daily d
+                    WHERE d.expense_count > 0
+                        AND d.txn_date >= CURRENT_DATE - make_interval(months => $1)
+                    GROUP BY d.user_id, d.category_id, DATE_TRUNC('month', d.txn_date)
                 ) spent ON bi.category_id = spent.category_id 
                     AND b.user_id = spent.user_id
                     AND DATE_TRUNC('month', b.period_start) = spent.month
-                WHERE b.user_id IN (%s)
-                    AND bi.category_id = %s
-                    AND b.period_start >= CURRENT_DATE - INTERVAL '%s months'
+                WHERE b.user_id = ANY($2)
+                    AND bi.category_id = ANY($3)
+                    AND b.period_start >= CURRENT_DATE - make_interval(months => $1)
             )
             SELECT 
+                category_id,
                 AVG(planned_cents) as avg_peer_budget,
                 AVG(actual_spent) as avg_peer_spending,
                 AVG(budget_variance) as avg_variance,
@@ -854,31 +1551,33 @@ class AdvancedBudgetPredictor:
                 MAX(planned_cents) as max_budget
             FROM peer_budgets
             WHERE planned_cents > 0
+            GROUP BY category_id
             """
             
-            conn = psycopg2.connect(
-                host=os.getenv('DB_HOST', 'postgres'),
-                database=os.getenv('DB_NAME', 'finance_tracker'),
-                user=os.getenv('DB_USER', 'finance_user'),
-                password=os.getenv('DB_PASSWORD', 'finance_password'),
-                port=os.getenv('DB_PORT', '5432')
+            # psycopg2 adapts Python lists to ARRAY literals, so the statement text never changes
+            # and its plan is reused across calls
+            params = (
+                int(historical_months),
+                [int(peer_id) for peer_id in similar_users],
+                [int(category_id) for category_id in category_ids],
             )
-            cursor = conn.cursor()
-            cursor.execute(query, [historical_months, similar_users_str, target_category_id, historical_months])
-            result = cursor.fetchone()
-            conn.close()
+            with self.get_db_connection() as conn, conn.cursor() as cursor:
+                self._execute_prepared(cursor, 'ml_peer_recommendations', PEER_PARAM_TYPES, query, params)
+                rows = cursor.fetchall()
             
-            if result and result[0]:
-                return {
-                    'avg_peer_budget': result[0],
-                    'avg_peer_spending': result[1] or 0,
-                    'avg_variance': result[2] or 0,
-                    'peer_samples': result[3],
-                    'budget_std': result[4] or 0,
-                    'min_budget': result[5],
-                    'max_budget': result[6],
+            return {
+                int(row[0]): {
+                    'avg_peer_budget': row[1],
+                    'avg_peer_spending': row[2] or 0,
+                    'avg_variance': row[3] or 0,
+                    'peer_samples': row[4],
+                    'budget_std': row[5] or 0,
+                    'min_budget': row[6],
+                    'max_budget': row[7],
                     'peer_count': len(similar_users)
                 }
+                for row in rows if row[1]
+            }
             
         except Exception as e:
             logger.error(f"Error getting peer recommendations: {e}")
@@ -888,48 +1587,15 @@ class AdvancedBudgetPredictor:
     def _generate_user_insights(self, user_cluster_info: Dict, cluster_profile: Dict) -> List[str]:
         """Generate personalized insights based on user's cluster"""
         
-        insights = []
-        
         if not cluster_profile:
             return ["Not enough data for personalized insights"]
         
-        # Budget adherence insights
-        budget_adherence = cluster_profile.get('avg_budget_adherence', 0)
-        if budget_adherence > 0.8:
-            insights.append("You're in a group of highly disciplined budgeters who stick close to their plans")
-        elif budget_adherence > 0.6:
-            insights.append("You're among users with good budget discipline, with room for improvement")
-        else:
-            insights.append("You're in a group that tends to go over budget - consider more realistic planning")
-        
-        # Spending level insights
-        monthly_spending = cluster_profile.get('avg_monthly_spending', 0)
-        if monthly_spending > 300000:  # > $3000
-            insights.append("You're in a high-spending group - focus on identifying savings opportunities")
-        elif monthly_spending > 150000:  # > $1500
-            insights.append("You're in a moderate-spending group with balanced financial habits")
-        else:
-            insights.append("You're in a conservative-spending group - great for building savings")
-        
-        # Category diversity insights
-        categories = cluster_profile.get('avg_categories', 0)
-        if categories > 8:
-            insights.append("Your group tracks spending across many categories - excellent for detailed budgeting")
-        elif categories > 5:
-            insights.append("Your group maintains good spending visibility across key categories")
-        else:
-            insights.append("Your group prefers simple budgeting with fewer categories")
-        
-        # Experience insights
-        age_months = cluster_profile.get('avg_age_months', 0)
-        if age_months > 12:
-            insights.append("You're grouped with experienced users who have established spending patterns")
-        else:
-            insights.append("You're among newer users still developing their budgeting habits")
-        
-        return insights
+        # cluster_users works these out for every cluster at once
+        if 'insights' in cluster_profile:
+            return list(cluster_profile['insights'])
+        return cluster_insights([cluster_profile])[0]
     
-    def predict_with_ml(self, user_id: int, target_month: int, target_year: int, historical_months: int = 18) -> List[MLBudgetPrediction]:
+    def predict_with_ml(self, user_id: int, target_month: int, target_year: int, historical_months: int = 18) -> PredictionBatch:
         """Generate ML-based budget predictions"""
         
         try:
@@ -937,16 +1603,16 @@ class AdvancedBudgetPredictor:
             budgets_df, spending_df, accounts_df = self.fetch_comprehensive_data(user_id, historical_months)
             
             if budgets_df.empty:
-                return []
+                return PredictionBatch()
             
             # Engineer features
             features_df = self.engineer_features(budgets_df, spending_df, accounts_df)
             
             if features_df.empty:
-                return []
+                return PredictionBatch()
             
             # Build ML models
-            models = self.build_ml_models(features_df)
+            models = self.build_ml_models(features_df, user_id)
             
             # Classify spending behaviors
             spending_clusters = self.classify_spending_behavior(features_df)
@@ -955,411 +1621,251 @@ class AdvancedBudgetPredictor:
             seasonal_patterns = self.detect_seasonal_patterns(features_df)
             
             # Create user clusters for collaborative filtering
-            user_profiles_df = self.create_user_profiles(historical_months)
-            user_clusters = self.cluster_users(user_profiles_df)
+            user_clusters = self.get_user_clusters(historical_months)
             
-            logger.info(f"User clustering: {len(user_clusters)} users clustered, user {user_id} in cluster {user_clusters.get(user_id, {}).get('cluster_id', 'Unknown')}")
+            logger.info("User clustering: %d users clustered, user %s in cluster %s",
+                        len(user_clusters), user_id, user_clusters.get(user_id, {}).get('cluster_id', 'Unknown'))
             
-            # Generate predictions for each category
-            predictions = []
+            # Generate predictions for each category; the string columns are collected in category order
+            models_used, reasons = [], []
+            spending_cluster_labels, seasonal_pattern_labels = [], []
             
-            category_ids = features_df['category_id'].unique()
-            logger.info(f"Processing {len(category_ids)} categories: {list(category_ids)}")
+            # One grouping pass splits the rows by category, in order of first appearance
+            category_groups = features_df.groupby('category_id', sort=False)
+            category_counts = category_groups.size()
+            logger.info("Processing %d categories: %s", len(category_counts), category_counts.index.tolist())
             
-            for category_id in category_ids:
-                logger.info(f"Starting prediction for category {category_id}")
-                category_data = features_df[features_df['category_id'] == category_id]
-                latest_data = category_data.iloc[-1]  # Most recent data for this category
-                
-                # Prepare features for prediction
-                prediction_features = self._prepare_prediction_features(
-                    latest_data, target_month, target_year
-                )
+            # Fetch peer stats up front for every category thin enough to fall back on peers
+            peer_stats = {}
+            if user_id in user_clusters:
+                peer_category_ids = category_counts.index[category_counts < 5].tolist()
+                if peer_category_ids:
+                    peer_stats = self.get_peer_recommendations_bulk(user_id, peer_category_ids, user_clusters, historical_months=6)
+            
+            categories = list(category_groups)
+            # Most recent row of each category. The loop below reads its few per-category fields from
+            # plain lists taken from these rows once, with missing counts defaulting to 0.
+            latest_positions = [category_groups.indices[category_id][-1] for category_id, _ in categories]
+            latest_df = features_df.iloc[latest_positions]
+            category_names = [str(name) for name in latest_df['category_name'].tolist()]
+            historical_counts, spent_counts = latest_df.reindex(
+                columns=['historical_count', 'historical_spent_count'], fill_value=0
+            ).to_numpy().T.tolist()
+            
+            # Predict every category with each model in one call: one feature row per category,
+            # scaled once, and a (model, category) array of the results
+            model_names = [
+                name for name, model in (models or {}).items()
+                if name not in ['feature_importance', 'scaler'] and hasattr(model, 'predict')
+            ]
+            model_predictions = np.full((len(model_names), len(categories)), np.nan)
+            
+            if model_names:
+                X_pred = self._prepare_prediction_features_batch(latest_df, target_month, target_year)
                 
-                # Make predictions using available models
-                predictions_dict = {}
+                # Only scale if we have valid data
+                try:
+                    X_pred_scaled = models['scaler'].transform(X_pred, copy=True)
+                except Exception as e:
+                    logger.warning("Scaling failed: %s, using unscaled features", e)
+                    X_pred_scaled = X_pred
                 
-                if models and len(models) > 0:
-                    feature_columns = [
-                        'month_sin', 'month_cos', 'quarter_sin', 'quarter_cos',
-                        'historical_mean', 'historical_spent_mean', 'historical_std', 'historical_trend', 'historical_count',
-                        'recent_mean', 'recent_trend', 'actual_spent', 'spending_frequency',
-                        'avg_transaction_size', 'spending_volatility', 'budget_accuracy',
-                        'account_diversity', 'primary_account_usage'
-                    ]
-                    
-                    X_pred = np.array([[prediction_features.get(col, 0) for col in feature_columns]])
-                    
-                    # Clean prediction features and handle NaN values
-                    X_pred = np.nan_to_num(X_pred, nan=0.0, posinf=0.0, neginf=0.0)
-                    
-                    # Only scale if we have valid data
+                # Get predictions from each model
+                for i, model_name in enumerate(model_names):
                     try:
-                        X_pred_scaled = self.scaler.transform(X_pred)
+                        # Only the linear model was trained on scaled features
+                        model_predictions[i] = models[model_name].predict(X_pred if model_name in UNSCALED_MODELS else X_pred_scaled)
                     except Exception as e:
-                        logger.warning(f"Scaling failed: {e}, using unscaled features")
-                        X_pred_scaled = X_pred
-                    
-                    # Get predictions from each model
-                    for model_name, model in models.items():
-                        if model_name not in ['feature_importance'] and hasattr(model, 'predict'):
-                            try:
-                                pred = model.predict(X_pred_scaled)[0]
-                                # Ensure prediction is valid
-                                if np.isfinite(pred) and pred >= 0:
-                                    predictions_dict[model_name] = float(pred)
-                                else:
-                                    logger.warning(f"Model {model_name} produced invalid prediction: {pred}")
-                            except Exception as e:
-                                logger.warning(f"Model {model_name} prediction failed: {e}")
-                
-                # Initialize default values
-                # Use budget historical mean as baseline for predictions (keep them separate)
-                budget_historical_avg = float(latest_data.get('historical_mean', 0.0))
-                spending_historical_avg = float(latest_data.get('historical_spent_mean', 0.0))
+                        logger.warning("Model %s prediction failed: %s", model_name, e)
+            
+            # Ensemble prediction per category: the mean of the valid model predictions (finite and
+            # non-negative; failed or invalid ones are left out), with their agreement for confidence
+            valid = np.isfinite(model_predictions) & (model_predictions >= 0)
+            for i, position in zip(*np.nonzero(~valid & ~np.isnan(model_predictions))):
+                logger.warning("Model %s produced invalid prediction: %s", model_names[i], model_predictions[i, position])
+            valid_counts = valid.sum(axis=0)
+            has_ml = valid_counts > 0
+            
+            # Use budget historical mean as baseline for predictions (keep the spending mean separate)
+            budget_avgs = latest_df['historical_mean'].to_numpy(dtype=float)
+            spending_avgs = latest_df['historical_spent_mean'].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ml_amounts = np.where(has_ml, np.where(valid, model_predictions, 0.0).sum(axis=0) / valid_counts, budget_avgs)
+                ml_std = np.sqrt((np.where(valid, model_predictions - ml_amounts, 0.0) ** 2).sum(axis=0) / valid_counts)
+                model_agreements = np.where(
+                    valid_counts > 1,
+                    np.where(ml_amounts > 0, np.maximum(0.3, 1.0 - ml_std / ml_amounts), 0.5),
+                    0.7
+                )
+            
+            # Check data quality to determine if we should suggest changes; data points are all of
+            # the category's rows, not just historical ones
+            data_points = np.array([len(category_data) for _, category_data in categories])
+            accuracies = latest_df['budget_accuracy'].to_numpy(dtype=float)
+            use_peers = (data_points < 5) & (user_id in user_clusters)
+            peer_rows = [peer_stats.get(int(category_id), {}) for category_id, _ in categories]
+            
+            # Determine every category's prediction strategy based on data quality
+            predicted_amounts, confidences, strategies = choose_prediction_strategies(
+                budget_avgs, spending_avgs, ml_amounts, model_agreements, has_ml, data_points, accuracies, use_peers,
+                np.array([float(peer_data.get('avg_peer_budget', 0)) for peer_data in peer_rows]),
+                np.array([int(peer_data.get('peer_samples', 0)) for peer_data in peer_rows])
+            )
+            fallback = np.array(strategies) == 'fallback'
+            if fallback.any():
+                fallback_amounts = self._statistical_fallback_predictions(
+                    features_df['target_amount'].to_numpy(dtype=float), category_groups.ngroup().to_numpy(), len(categories)
+                )
+                predicted_amounts[fallback] = fallback_amounts[fallback]
+            trend_directions = self._classify_trends(latest_df['historical_trend'].to_numpy(dtype=float))
+            # Ensure confidence is within reasonable bounds
+            confidences = np.clip(confidences, 0.1, 0.95)
+            
+            # The per-category diagnostics below are checked against the level once per request;
+            # with INFO disabled none of their arguments are computed
+            log_details = logger.isEnabledFor(logging.INFO)
+            
+            for position, (category_id, _) in enumerate(categories):
+                category_name = category_names[position]
+                budget_historical_avg = float(budget_avgs[position])
+                spending_historical_avg = float(spending_avgs[position])
                 historical_avg = budget_historical_avg  # Use budget mean as prediction baseline
+                strategy = strategies[position]
                 
-                # Initialize prediction variables for this category (prevent carryover from previous categories)
-                predicted_amount = None
-                model_used = None
-                confidence = None
-                
-                # Log both averages for transparency
-                logger.info(f"  Budget historical avg: ${budget_historical_avg/100:.2f}")
-                if latest_data.get('historical_spent_count', 0) > 0:
-                    logger.info(f"  Spending historical avg: ${spending_historical_avg/100:.2f} (periods: {int(latest_data['historical_spent_count'])})")
-                else:
-                    logger.info(f"  No spending history available")
-                logger.info(f"  Using budget avg as baseline: ${historical_avg/100:.2f}")
-                
-                ml_predicted_amount = historical_avg  # Default to historical
-                model_agreement = 0.7
-                max_reasonable_change = historical_avg * 0.5
-                ml_change = 0.0
-                
-                # Ensemble prediction (average of available models)
-                if predictions_dict:
-                    ml_predicted_amount = np.mean(list(predictions_dict.values()))
-                    
-                    # Calculate model agreement for confidence
-                    if len(predictions_dict) > 1:
-                        pred_std = np.std(list(predictions_dict.values()))
-                        pred_mean = np.mean(list(predictions_dict.values()))
-                        model_agreement = max(0.3, 1.0 - (pred_std / pred_mean)) if pred_mean > 0 else 0.5
+                # Debug logging to see what's happening; the arithmetic only runs when it is logged
+                if log_details:
+                    logger.info("Starting prediction for category %s", category_id)
+                    # Log both averages for transparency
+                    logger.info("  Budget historical avg: $%.2f", budget_historical_avg / 100)
+                    spending_periods = spent_counts[position]
+                    if spending_periods > 0:
+                        logger.info("  Spending historical avg: $%.2f (periods: %d)", spending_historical_avg / 100, spending_periods)
                     else:
-                        model_agreement = 0.7
+                        logger.info("  No spending history available")
+                    logger.info("  Using budget avg as baseline: $%.2f", historical_avg / 100)
                     
+                    ml_predicted_amount = ml_amounts[position]
                     # Check if ML prediction is reasonable (within 50% of historical)
-                    ml_change = abs(ml_predicted_amount - historical_avg)
-                
-                # Check data quality to determine if we should suggest changes
-                data_points = len(category_data)  # Total data points for this category, not just historical
-                accuracy = latest_data.get('budget_accuracy', 0.5)
-                
-                # Debug logging to see what's happening
-                logger.info(f"Category {latest_data['category_name']}: data_points={data_points}, accuracy={accuracy:.2f}, ml_change=${ml_change/100:.2f}")
-                logger.info(f"  ML predicted: ${ml_predicted_amount/100:.2f}, Historical: ${historical_avg/100:.2f}")
-                logger.info(f"  Budget avg: ${budget_historical_avg/100:.2f}, Spending avg: ${spending_historical_avg/100:.2f}")
-                logger.info(f"  Model agreement: {model_agreement:.2f}, Max reasonable change: ${max_reasonable_change/100:.2f}")
-                
-                # Debug the accurate budgeter condition
-                if spending_historical_avg > 0 and budget_historical_avg > 0:
-                    ratio = spending_historical_avg / budget_historical_avg
-                    ratio_diff = abs(ratio - 1.0)
-                    logger.info(f"  Accurate budgeter check: spending/budget ratio = {ratio:.3f}, diff from 1.0 = {ratio_diff:.3f}")
-                    logger.info(f"  Ratio diff < 0.02? {ratio_diff < 0.02}, Has predictions? {bool(predictions_dict)}")
-                
-                # Calculate base confidence based on data quality and spending history
-                base_confidence = min(0.9, 0.3 + (data_points * 0.08))  # More data = higher base confidence
-                
-                # Apply accuracy bonus/penalty - but first check if we actually have spending data
-                if accuracy > 0.7:  # Good accuracy (actual spending matches budgets well)
-                    accuracy_factor = 1.2
-                elif accuracy < 0.3:  # Poor accuracy (spending way off from budgets)
-                    accuracy_factor = 0.8
-                else:  # Neutral accuracy (0.3-0.7, including 0.5 for no spending data)
-                    accuracy_factor = 1.0
-                
-                # Determine prediction strategy based on data quality
-                if data_points < 3:
-                    # Use pure historical average for insufficient data
-                    predicted_amount = historical_avg
-                    confidence = base_confidence * 0.6  # Lower confidence for insufficient data
-                    model_used = f"Historical Average (only {int(data_points)} data points)"
-                    logger.info(f"  -> Using historical (insufficient data points)")
-                elif accuracy < 0.2:  # Very poor accuracy
-                    # Use pure historical average for very poor accuracy
-                    predicted_amount = historical_avg
-                    confidence = base_confidence * accuracy_factor * 0.7
-                    model_used = "Historical Average (very low accuracy)"
-                    logger.info(f"  -> Using historical (very low accuracy)")
-                elif predictions_dict and spending_historical_avg > 0 and abs(spending_historical_avg / budget_historical_avg - 1.0) < 0.02:
-                    # PRIORITY CHECK: Perfect budgeters (spending within 2% of budget) - handle first!
-                    predicted_amount = max(budget_historical_avg, spending_historical_avg * 1.02)  # Small 2% buffer for inflation
-                    confidence = base_confidence * accuracy_factor * model_agreement * 0.92  # High confidence for accurate budgeters
-                    model_used = f"Accurate Budgeter (spending ≈ budget)"
-                    logger.info(f"  -> PRIORITY: Accurate budgeter detected, maintaining budget: ${predicted_amount/100:.2f}")
-                elif data_points < 5 and user_id in user_clusters:
-                    # PEER RECOMMENDATIONS: For users with limited data, use similar users' patterns
-                    logger.info(f"  -> Checking peer recommendations for {latest_data['category_name']} (data_points={data_points})")
-                    peer_data = self.get_peer_recommendations(user_id, category_id, user_clusters, historical_months=6)
+                    ml_change = abs(ml_predicted_amount - historical_avg) if has_ml[position] else 0.0
+                    logger.info("Category %s: data_points=%d, accuracy=%.2f, ml_change=$%.2f",
+                                category_name, data_points[position], accuracies[position], ml_change / 100)
+                    logger.info("  ML predicted: $%.2f, Historical: $%.2f", ml_predicted_amount / 100, historical_avg / 100)
+                    logger.info("  Budget avg: $%.2f, Spending avg: $%.2f", budget_historical_avg / 100, spending_historical_avg / 100)
+                    logger.info("  Model agreement: %.2f, Max reasonable change: $%.2f", model_agreements[position], historical_avg * 0.5 / 100)
                     
-                    if peer_data and peer_data.get('peer_samples', 0) >= 3:
-                        peer_budget = peer_data['avg_peer_budget']
-                        peer_spending = peer_data.get('avg_peer_spending', peer_budget)
-                        peer_confidence = min(0.8, 0.4 + (peer_data['peer_samples'] * 0.05))  # Confidence based on peer sample size
-                        
-                        # Blend peer recommendation with any available personal data
-                        if historical_avg > 0:
-                            # User has some history, blend with peer data
-                            peer_weight = min(0.6, peer_data['peer_samples'] / 10)  # More peers = higher weight
-                            predicted_amount = historical_avg * (1 - peer_weight) + peer_budget * peer_weight
-                            model_used = f"Peer-Informed Prediction ({peer_data['peer_count']} similar users)"
-                        else:
-                            # New user, rely more heavily on peer data
-                            predicted_amount = peer_budget
-                            model_used = f"Peer-Based Recommendation ({peer_data['peer_count']} similar users)"
-                        
-                        confidence = peer_confidence
-                        logger.info(f"  -> Using peer recommendations: ${predicted_amount/100:.2f} (peers: {peer_data['peer_count']}, samples: {peer_data['peer_samples']})")
-                    else:
-                        logger.info(f"  -> Peer recommendations insufficient: {peer_data}")
-                        # Fall through to next condition - but don't leave predicted_amount unset!
-                        predicted_amount = None  # Mark as needing to be set by subsequent logic
-                        model_used = None
-                elif predictions_dict and accuracy == 0.5:  # Special case for neutral accuracy (no spending data)
-                    # Use ML blend but with moderate confidence for neutral accuracy
-                    if ml_change > max_reasonable_change:
-                        predicted_amount = historical_avg * 0.9 + ml_predicted_amount * 0.1
-                        confidence = base_confidence * model_agreement * 0.7
-                        model_used = "Conservative Historical (ML too extreme, neutral accuracy)"
-                        logger.info(f"  -> Using mostly historical (extreme + neutral accuracy)")
-                    else:
-                        predicted_amount = historical_avg * 0.8 + ml_predicted_amount * 0.2
-                        confidence = base_confidence * model_agreement * 0.85
-                        model_used = f"Conservative Ensemble (neutral accuracy)"
-                        logger.info(f"  -> Using ML blend with neutral accuracy")
-                elif predictions_dict and accuracy > 0.5:  # Good accuracy - we have spending data that matches budgets
-                    # When spending matches budgets well, be more aggressive with ML suggestions
-                    if spending_historical_avg > 0 and spending_historical_avg > budget_historical_avg * 1.05:
-                        # If actual spending is consistently higher than budgets, suggest closer to spending amount
-                        suggested_base = max(budget_historical_avg, spending_historical_avg * 0.95)  # At least 95% of spending avg
-                        predicted_amount = suggested_base * 0.7 + ml_predicted_amount * 0.3
-                        model_used = "Spending-Informed Ensemble (spending > budget)"
-                        logger.info(f"  -> Using spending-informed blend (high spender): ${predicted_amount/100:.2f}")
-                    elif ml_change > max_reasonable_change:
-                        # ML prediction is too extreme, use mostly historical average
-                        predicted_amount = historical_avg * 0.95 + ml_predicted_amount * 0.05
-                        model_used = f"Conservative Historical (ML too extreme)"
-                        logger.info(f"  -> Using historical (ML too extreme)")
-                    else:
-                        # Good accuracy and reasonable ML change, trust it more
-                        predicted_amount = historical_avg * 0.6 + ml_predicted_amount * 0.4
-                        model_used = f"Confident Ensemble (good accuracy)"
-                        logger.info(f"  -> Using confident ML blend: ${predicted_amount/100:.2f}")
-                    
-                    confidence = base_confidence * accuracy_factor * model_agreement * 0.85
-                elif predictions_dict and ml_change < historical_avg * 0.02:  # Less than 2% change
-                    # Very small change, just use historical average
-                    predicted_amount = historical_avg
-                    confidence = base_confidence * accuracy_factor * model_agreement * 0.95
-                    model_used = "Historical Average (stable pattern)"
-                    logger.info(f"  -> Using historical (stable pattern, change < 2%)")
-                elif predictions_dict:
-                    # ML prediction is reasonable, blend smartly based on spending vs budget history
-                    
-                    # If we have spending history, use it to inform our decision
-                    if spending_historical_avg > 0:
-                        spending_vs_budget_ratio = spending_historical_avg / budget_historical_avg
-                        
-                        if spending_vs_budget_ratio > 1.05:  # Consistently overspend by 5%+
-                            # Suggest closer to spending average since they tend to overspend
-                            predicted_amount = min(ml_predicted_amount, spending_historical_avg * 1.1)  # Cap at 110% of spending avg
-                            model_used = f"Spending-Aware Ensemble (tend to overspend)"
-                            logger.info(f"  -> Using spending-aware blend (overspender): ${predicted_amount/100:.2f}")
-                        elif spending_vs_budget_ratio < 0.95:  # Consistently underspend by 5%+
-                            # They're good at staying under budget, ML prediction is probably reasonable
-                            predicted_amount = budget_historical_avg * 0.7 + ml_predicted_amount * 0.3
-                            model_used = f"Conservative Ensemble (good at budgeting)"
-                            logger.info(f"  -> Using conservative blend (good budgeter): ${predicted_amount/100:.2f}")
-                        else:  # Spending is close to budget (95-105%) - note: very accurate (98-102%) handled above
-                            # They're reasonable budgeters, trust a blend more heavily weighted toward spending
-                            predicted_amount = spending_historical_avg * 0.8 + ml_predicted_amount * 0.2
-                            model_used = f"Balanced Ensemble (reasonable budgeter)"
-                            logger.info(f"  -> Using balanced blend (reasonable): ${predicted_amount/100:.2f}")
-                    else:
-                        # No spending history, use conservative ML blend with budget baseline
-                        predicted_amount = budget_historical_avg * 0.85 + ml_predicted_amount * 0.15
-                        model_used = f"Conservative Ensemble (no spending history)"
-                        logger.info(f"  -> Using conservative ML blend: ${predicted_amount/100:.2f}")
-                    
-                    confidence = base_confidence * accuracy_factor * model_agreement * 0.9
-                else:
-                    # Fallback to historical average
-                    predicted_amount = self._statistical_fallback_prediction(category_data, target_month)
-                    model_used = "Historical Average"
-                    confidence = base_confidence * 0.7
-                    logger.info(f"  -> Using fallback historical average")
-                
-                # Safety check: ensure predicted_amount and model_used are always set
-                if predicted_amount is None or model_used is None:
-                    logger.warning(f"  -> SAFETY: predicted_amount or model_used not set, using fallback for {latest_data['category_name']}")
-                    predicted_amount = historical_avg
-                    model_used = "Fallback Historical Average"
-                    confidence = base_confidence * 0.6
-                
-                # Ensure confidence is within reasonable bounds
-                confidence = max(0.1, min(0.95, confidence))
-                
-                # Debug: Log the final prediction path taken
-                logger.info(f"  -> FINAL: {latest_data['category_name']} prediction: ${predicted_amount/100:.2f}, model: {model_used}")
+                    # Debug the accurate budgeter condition
+                    if spending_historical_avg > 0 and budget_historical_avg > 0:
+                        ratio_diff = abs(spending_historical_avg / budget_historical_avg - 1.0)
+                        logger.info("  Accurate budgeter check: spending/budget ratio = %.3f, diff from 1.0 = %.3f",
+                                    spending_historical_avg / budget_historical_avg, ratio_diff)
+                        logger.info("  Ratio diff < 0.02? %s, Has predictions? %s", ratio_diff < 0.02, bool(has_ml[position]))
                 
-                # Get feature importance (works for both ML and fallback cases)
-                feature_importance = models.get('feature_importance', {}) if models else {}
-                
-                # Create prediction object for ALL cases
-                prediction = MLBudgetPrediction(
-                    category_id=int(category_id),
-                    category_name=str(latest_data['category_name']),
-                    predicted_amount_cents=int(predicted_amount),
-                    confidence_score=float(confidence),
-                    historical_avg_cents=int(historical_avg),  # Budget historical average
-                    historical_spending_avg_cents=int(spending_historical_avg),  # Spending historical average
-                    trend_direction=self._classify_trend(latest_data['historical_trend']),
-                    ml_model_used=model_used,
-                    feature_importance=feature_importance,
-                    spending_cluster=spending_clusters.get(category_id, "Unknown"),
-                    seasonal_pattern=seasonal_patterns.get(category_id, "Unknown"),
-                    reasoning=self._generate_ml_reasoning(
-                        latest_data, predicted_amount, model_used, 
-                        spending_clusters.get(category_id, "Unknown"),
-                        seasonal_patterns.get(category_id, "Unknown"),
-                        budget_historical_avg, spending_historical_avg  # Pass both budget and spending averages
-                    )
+                # Every strategy sets an amount (fallback ones were filled in above) and has a label
+                predicted_amount = float(predicted_amounts[position])
+                model_used = PREDICTION_STRATEGIES[strategy].format(
+                    data_points=int(data_points[position]), peer_count=peer_rows[position].get('peer_count', 0)
                 )
+                if log_details:
+                    logger.info("  -> Strategy %s: $%.2f (%s)", strategy, predicted_amount / 100, model_used)
+                    # Debug: Log the final prediction path taken
+                    logger.info("  -> FINAL: %s prediction: $%.2f, model: %s", category_name, predicted_amount / 100, model_used)
                 
-                predictions.append(prediction)
-                logger.info(f"Added prediction for category {category_id} ({latest_data['category_name']}). Total predictions so far: {len(predictions)}")
+                spending_cluster = spending_clusters.get(category_id, "Unknown")
+                seasonal_pattern = seasonal_patterns.get(category_id, "Unknown")
+                models_used.append(model_used)
+                spending_cluster_labels.append(spending_cluster)
+                seasonal_pattern_labels.append(seasonal_pattern)
+                reasons.append(self._generate_ml_reasoning(
+                    historical_counts[position], predicted_amount, strategy, spending_cluster, seasonal_pattern,
+                    budget_historical_avg, spending_historical_avg  # Pass both budget and spending averages
+                ))
+                if log_details:
+                    logger.info("Added prediction for category %s (%s). Total predictions so far: %d", category_id, category_name, len(reasons))
             
             # Final logging (outside the for loop)
-            logger.info(f"Completed prediction loop. Total predictions: {len(predictions)}")
+            logger.info("Completed prediction loop. Total predictions: %d", len(reasons))
             
             # Sort by confidence score
-            predictions.sort(key=lambda x: x.confidence_score, reverse=True)
-            
-            return predictions
+            order = np.argsort(-confidences, kind='stable')
+            in_order = lambda values: [values[i] for i in order]
+            return PredictionBatch(
+                category_ids=np.array([int(category_id) for category_id, _ in categories], dtype=np.int64)[order],
+                category_names=in_order(category_names),
+                predicted_amount_cents=predicted_amounts[order].astype(np.int64),
+                confidence_scores=confidences[order],
+                historical_avg_cents=budget_avgs[order].astype(np.int64),  # Budget historical average
+                historical_spending_avg_cents=spending_avgs[order].astype(np.int64),  # Spending historical average
+                trend_directions=in_order(trend_directions),
+                models_used=in_order(models_used),
+                spending_clusters=in_order(spending_cluster_labels),
+                seasonal_patterns=in_order(seasonal_pattern_labels),
+                reasons=in_order(reasons),
+                # Works for both ML and fallback cases
+                feature_importance=MappingProxyType(models.get('feature_importance', {}) if models else {})
+            )
         
         except Exception as e:
             logger.error(f"ML prediction failed: {e}")
-            return []
+            return PredictionBatch()
     
-    def _prepare_prediction_features(self, latest_data: pd.Series, target_month: int, target_year: int) -> Dict:
-        """Prepare features for prediction"""
+    def _prepare_prediction_features_batch(self, latest_df: pd.DataFrame, target_month: int, target_year: int) -> np.ndarray:
+        """Prepare the prediction matrix, one row per category in FEATURE_COLUMNS order"""
         
-        features = {}
+        features = np.zeros((len(latest_df), len(FEATURE_COLUMNS)), dtype=np.float32)
         
-        # Target month features
-        features['month_sin'] = np.sin(2 * np.pi * target_month / 12)
-        features['month_cos'] = np.cos(2 * np.pi * target_month / 12)
+        # Target month features, the same for every row
         target_quarter = (target_month - 1) // 3 + 1
-        features['quarter_sin'] = np.sin(2 * np.pi * target_quarter / 4)
-        features['quarter_cos'] = np.cos(2 * np.pi * target_quarter / 4)
-        
-        # Historical features (carry forward from latest data)
-        for col in ['historical_mean', 'historical_std', 'historical_trend', 'historical_count',
-                   'recent_mean', 'recent_trend', 'actual_spent', 'spending_frequency',
-                   'avg_transaction_size', 'spending_volatility', 'budget_accuracy',
-                   'account_diversity', 'primary_account_usage']:
-            value = latest_data.get(col, 0)
-            # Ensure value is finite and not NaN
-            if pd.isna(value) or not np.isfinite(value):
-                features[col] = 0.0
-            else:
-                features[col] = float(value)
+        for name, value in cyclical_encoding(target_month, target_quarter).items():
+            features[:, FEATURE_COLUMNS.index(name)] = value[0]
+        
+        # Historical features carried forward from each category's latest row; NaN and
+        # infinite values become 0
+        carried = latest_df.reindex(columns=PREDICTION_CARRIED_COLUMNS, fill_value=0).to_numpy(dtype=np.float32)
+        features[:, PREDICTION_CARRIED_POSITIONS] = np.nan_to_num(carried, nan=0.0, posinf=0.0, neginf=0.0)
         
         return features
     
-    def _statistical_fallback_prediction(self, category_data: pd.DataFrame, target_month: int) -> float:
-        """Fallback prediction using enhanced statistical methods"""
-        
-        if len(category_data) == 0:
-            return 0.0
-        
-        # Use historical average without adjustments
-        amounts = category_data['target_amount'].values
-        return float(np.mean(amounts))
+    def _statistical_fallback_predictions(self, target_amounts: np.ndarray, category_codes: np.ndarray, category_count: int) -> np.ndarray:
+        """Fallback prediction for every category: its historical average without adjustments"""
+        # category_codes[i] is the category position of row i; categories without rows predict 0
+        counts = np.bincount(category_codes, minlength=category_count)
+        totals = np.bincount(category_codes, weights=target_amounts, minlength=category_count)
+        return np.divide(totals, counts, out=np.zeros(category_count), where=counts > 0)
     
-    def _classify_trend(self, trend_slope: float) -> str:
-        """Classify trend direction"""
-        if trend_slope > 100:  # More than $1 increase per period
-            return "increasing"
-        elif trend_slope < -100:  # More than $1 decrease per period
-            return "decreasing"
-        else:
-            return "stable"
+    def _classify_trends(self, trend_slopes: np.ndarray) -> List[str]:
+        """Classify the trend direction of each slope (cents per period)"""
+        # -1, 0 or +1 for a decrease, no change or increase beyond the threshold (NaN counts as stable)
+        directions = (trend_slopes > TREND_SLOPE_THRESHOLD).astype(np.int8) - (trend_slopes < -TREND_SLOPE_THRESHOLD)
+        return [TREND_DIRECTIONS[direction + 1] for direction in directions.tolist()]
     
-    def _generate_ml_reasoning(self, data: pd.Series, predicted_amount: float, model_used: str, 
+    def _generate_ml_reasoning(self, historical_count: float, predicted_amount: float, strategy: str, 
                               cluster: str, seasonal_pattern: str, budget_historical_avg: float, spending_historical_avg: float) -> str:
         """Generate reasoning for ML prediction"""
         
-        reasons = []
+        # Historical context (main basis), amounts in dollars
+        amounts = {'budget': budget_historical_avg / 100, 'predicted': predicted_amount / 100}
+        amounts['difference'] = amounts['predicted'] - amounts['budget']
         
-        # Historical context (main basis)
-        budget_avg_dollars = budget_historical_avg / 100
-        predicted_dollars = predicted_amount / 100
-        
-        # Different reasoning based on model used
-        if "Accurate Budgeter" in model_used:
-            reasons.append(f"Maintaining budget ${budget_avg_dollars:.2f} (accurate budgeter)")
-            difference = predicted_dollars - budget_avg_dollars
-            if abs(difference) > 0.50:  # More than 50 cents difference
-                if difference > 0:
-                    reasons.append(f"small +${difference:.2f} inflation buffer")
-                else:
-                    reasons.append(f"${difference:.2f} adjustment")
-        elif "Peer-Based" in model_used or "Peer-Informed" in model_used:
-            reasons.append(f"Based on similar users: ${predicted_dollars:.2f}")
-            if budget_avg_dollars > 0:
-                difference = predicted_dollars - budget_avg_dollars
-                if abs(difference) > 0.50:
-                    if difference > 0:
-                        reasons.append(f"peers suggest +${difference:.2f} vs your history")
-                    else:
-                        reasons.append(f"peers suggest ${difference:.2f} vs your history")
-        elif "Historical Average" in model_used:
-            if "limited data" in model_used:
-                reasons.append(f"Based on budget average ${budget_avg_dollars:.2f} (limited data)")
-            elif "stable pattern" in model_used:
-                reasons.append(f"Based on budget average ${budget_avg_dollars:.2f} (stable pattern)")
-            else:
-                reasons.append(f"Based on budget average ${budget_avg_dollars:.2f}")
-        else:
-            reasons.append(f"Conservative ML prediction")
-            reasons.append(f"budget average ${budget_avg_dollars:.2f}")
-            
-            # Show the adjustment if significant
-            difference = predicted_dollars - budget_avg_dollars
-            if abs(difference) > 0.50:  # More than 50 cents difference
-                if difference > 0:
-                    reasons.append(f"ML suggests +${difference:.2f} adjustment")
-                else:
-                    reasons.append(f"ML suggests ${difference:.2f} adjustment")
+        # Different reasoning based on the strategy used
+        basis, increase, decrease = REASONING_TEMPLATES[strategy]
+        reasons = [basis.format_map(amounts)]
+        # Show the adjustment if significant (more than 50 cents difference)
+        if increase and abs(amounts['difference']) > 0.50:
+            reasons.append((increase if amounts['difference'] > 0 else decrease).format_map(amounts))
         
         # Add spending history context if available
         if spending_historical_avg > 0:
-            spending_avg_dollars = spending_historical_avg / 100
-            reasons.append(f"spending avg ${spending_avg_dollars:.2f}")
+            reasons.append(f"spending avg ${spending_historical_avg / 100:.2f}")
         
         # Spending behavior - more intelligent pattern description
-        if "Accurate Budgeter" in model_used:
+        if strategy == 'accurate_budgeter':
             # For accurate budgeters, focus on their accuracy rather than volatility
             reasons.append("consistent spending pattern")
         elif cluster != "Unknown":
             reasons.append(f"{cluster.lower()} spending pattern")
         
         # Data quality indicators
-        data_points = data.get('historical_count', 0)
-        if data_points < 3:
+        if historical_count < 3:
             reasons.append("(limited historical data)")
         
         return "; ".join(reasons)
@@ -1367,6 +1873,65 @@ class AdvancedBudgetPredictor:
 # Initialize predictor
 predictor = AdvancedBudgetPredictor()
 
+# Serialized /predict-budget responses keyed by (user_id, target_month, target_year, historical_months)
+prediction_cache = TTLCache(
+    maxsize=int(os.getenv('PREDICTION_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('PREDICTION_CACHE_TTL', '900'))
+)
+
+# Blocking database and model work runs on this pool so the event loop keeps serving other
+# requests. A task holds at most one pooled connection at a time, so ML_WORKERS must not
+# exceed DB_POOL_MAX.
+ml_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ML_WORKERS', '4')), thread_name_prefix='ml-worker')
+
+async def run_blocking(func: Callable, *args) -> Any:
+    """Run blocking predictor work on the ML thread pool and await its result"""
+    return await asyncio.get_running_loop().run_in_executor(ml_executor, func, *args)
+
+def require_internal_token(x_internal_token: str = Header(default='')) -> None:
+    """Reject calls to maintenance endpoints that do not carry the shared AI_INTERNAL_TOKEN"""
+    # Without a configured token the maintenance endpoints are disabled rather than open
+    expected = os.getenv('AI_INTERNAL_TOKEN', '')
+    if not expected or not hmac.compare_digest(x_internal_token.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+def _cache_prediction_response(cache_key: Tuple, result: PredictionResult) -> Response:
+    """Serialize a prediction result once, cache the JSON bytes and return them"""
+    payload = result.model_dump_json().encode()
+    prediction_cache.set(cache_key, payload)
+    return Response(content=payload, media_type="application/json")
+
+async def refresh_spending_summary_periodically():
+    """Rebuild ml_user_spending_daily every SPENDING_SUMMARY_REFRESH seconds while the service runs"""
+    interval = float(os.getenv('SPENDING_SUMMARY_REFRESH', '3600'))
+    while True:
+        refreshed = await run_blocking(predictor.refresh_spending_summary)
+        # Retry sooner when the database was unreachable, e.g. while it is still starting up
+        await asyncio.sleep(interval if refreshed else min(interval, 60))
+
+@app.on_event("startup")
+async def warm_up():
+    """Pay one-off initialization costs at startup instead of on the first request"""
+    # The first fit of each estimator spins up the OpenMP/BLAS thread pools sklearn uses; a
+    # throwaway fit on a small random matrix does that before any user is waiting
+    rng = np.random.default_rng(0)
+    X = StandardScaler(copy=False).fit_transform(rng.normal(size=(32, len(FEATURE_COLUMNS))).astype(np.float32))
+    y = rng.normal(size=32).astype(np.float32)
+    Ridge(alpha=1.0).fit(X, y)
+    HistGradientBoostingRegressor(max_iter=5, min_samples_leaf=5, random_state=42).fit(X, y)
+    KMeans(n_clusters=3, n_init=1, random_state=42).fit(MinMaxScaler().fit_transform(X[:, :4]))
+
+    # Open the pooled database connections now; the pool is created lazily again if this fails
+    try:
+        get_connection_pool()
+    except Exception as e:
+        logger.warning(f"Database not reachable at startup: {e}")
+
+    # ml_user_spending_daily is rebuilt in the background rather than on the request path
+    app.state.spending_summary_task = asyncio.get_running_loop().create_task(refresh_spending_summary_periodically())
+
+    logger.info("ML warm-up complete")
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
@@ -1381,16 +1946,25 @@ async def predict_budget(request: BudgetPredictionRequest):
     intelligent budget predictions using machine learning algorithms.
     """
     try:
+        cache_key = (request.user_id, request.target_month, request.target_year, request.historical_months)
+        cached_payload = prediction_cache.get(cache_key)
+        if cached_payload is not None:
+            logger.info(f"Serving cached ML prediction for user {request.user_id}, target: {request.target_month}/{request.target_year}")
+            return Response(content=cached_payload, media_type="application/json")
+        
         logger.info(f"ML prediction for user {request.user_id}, target: {request.target_month}/{request.target_year}")
         
         # Generate ML predictions
-        predictions = predictor.predict_with_ml(
+        predictions = await run_blocking(
+            predictor.predict_with_ml,
             request.user_id, 
             request.target_month, 
             request.target_year, 
             request.historical_months
         )
         
+        # Empty results are not cached: the fetches also come back empty when the database is
+        # briefly unavailable, and the user should get predictions as soon as it recovers
         if not predictions:
             return PredictionResult(
                 predictions=[],
@@ -1399,33 +1973,41 @@ async def predict_budget(request: BudgetPredictionRequest):
                 user_id=request.user_id,
                 ml_enabled=True,
                 model_info=ModelInfo(
-                    algorithms_used=["Linear Regression", "Random Forest", "K-Means Clustering"],
+                    algorithms_used=["Linear Regression", "Gradient Boosting", "K-Means Clustering"],
                     features_analyzed=["Seasonal patterns", "Spending trends", "Historical accuracy", "Account diversity"],
                     confidence_factors=["Model agreement", "Data quality", "Historical consistency"]
                 ),
                 message="No historical data available for ML predictions"
             )
         
-        # Convert to response format
-        predictions_response = []
-        for pred in predictions:
-            predictions_response.append(BudgetPredictionResponse(
-                category_id=int(pred.category_id),
-                category_name=str(pred.category_name),
-                predicted_amount_cents=int(pred.predicted_amount_cents),
-                predicted_amount_dollars=float(pred.predicted_amount_cents / 100),
-                confidence_score=float(pred.confidence_score),
-                historical_avg_cents=int(pred.historical_avg_cents),  # Budget historical average
-                historical_avg_dollars=float(pred.historical_avg_cents / 100),  # Budget historical average
-                historical_spending_avg_cents=int(pred.historical_spending_avg_cents),  # Spending historical average
-                historical_spending_avg_dollars=float(pred.historical_spending_avg_cents / 100),  # Spending historical average
-                trend_direction=str(pred.trend_direction),
-                ml_model_used=str(pred.ml_model_used),
-                feature_importance=pred.feature_importance,
-                spending_cluster=str(pred.spending_cluster),
-                seasonal_pattern=str(pred.seasonal_pattern),
-                reasoning=str(pred.reasoning)
-            ))
+        # Convert to response format. The batch columns already hold plain int/float/str values,
+        # so the responses are constructed without validating them again.
+        predictions_response = [
+            BudgetPredictionResponse.model_construct(
+                category_id=category_id,
+                category_name=category_name,
+                predicted_amount_cents=predicted_cents,
+                predicted_amount_dollars=predicted_cents / 100,
+                confidence_score=confidence_score,
+                historical_avg_cents=historical_cents,  # Budget historical average
+                historical_avg_dollars=historical_cents / 100,  # Budget historical average
+                historical_spending_avg_cents=spending_cents,  # Spending historical average
+                historical_spending_avg_dollars=spending_cents / 100,  # Spending historical average
+                trend_direction=trend_direction,
+                ml_model_used=model_used,
+                spending_cluster=spending_cluster,
+                seasonal_pattern=seasonal_pattern,
+                reasoning=reasoning
+            )
+            for (category_id, category_name, predicted_cents, confidence_score, historical_cents, spending_cents,
+                 trend_direction, model_used, spending_cluster, seasonal_pattern, reasoning) in zip(
+                predictions.category_ids.tolist(), predictions.category_names,
+                predictions.predicted_amount_cents.tolist(), predictions.confidence_scores.tolist(),
+                predictions.historical_avg_cents.tolist(), predictions.historical_spending_avg_cents.tolist(),
+                predictions.trend_directions, predictions.models_used, predictions.spending_clusters,
+                predictions.seasonal_patterns, predictions.reasons
+            )
+        ]
         
         response = PredictionResult(
             predictions=predictions_response,
@@ -1434,20 +2016,87 @@ async def predict_budget(request: BudgetPredictionRequest):
             user_id=int(request.user_id),
             ml_enabled=True,
             model_info=ModelInfo(
-                algorithms_used=["Linear Regression", "Random Forest", "K-Means Clustering"],
+                algorithms_used=["Linear Regression", "Gradient Boosting", "K-Means Clustering"],
                 features_analyzed=["Seasonal patterns", "Spending trends", "Historical accuracy", "Account diversity"],
-                confidence_factors=["Model agreement", "Data quality", "Historical consistency"]
+                confidence_factors=["Model agreement", "Data quality", "Historical consistency"],
+                feature_importance=predictions.feature_importance
             ),
             message=f"Generated {len(predictions)} ML-based budget predictions"
         )
         
         logger.info(f"Successfully generated {len(predictions)} ML predictions for user {request.user_id}")
-        return response
+        return _cache_prediction_response(cache_key, response)
         
     except Exception as e:
         logger.error(f"ML prediction error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.post("/invalidate/{user_id}", dependencies=[Depends(require_internal_token)])
+async def invalidate_predictions(user_id: int):
+    """Drop cached predictions for a user after their budgets or transactions change"""
+    # Called by the Go backend's budget and transaction write handlers
+    invalidated = prediction_cache.discard_where(lambda key: key[0] == user_id)
+    predictor._data_cache.discard_where(lambda key: key[0] == user_id)
+    logger.info(f"Invalidated {invalidated} cached predictions for user {user_id}")
+    return {"user_id": user_id, "invalidated": invalidated}
+
+@app.post("/refresh-clusters", dependencies=[Depends(require_internal_token)])
+async def refresh_clusters(historical_months: int = Query(default=18, ge=1, le=60, description="Number of historical months to analyze")):
+    """Rebuild the spending summary and user clusters now instead of waiting for the refresh interval"""
+    start = time.perf_counter()
+    user_clusters = await run_blocking(predictor.get_user_clusters, historical_months, True)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Rebuilt {len(user_clusters)} user clusters in {elapsed:.2f}s")
+    return {"historical_months": historical_months, "users_clustered": len(user_clusters), "seconds": round(elapsed, 3)}
+
+def _analyze_patterns(request: PatternAnalysisRequest) -> PatternAnalysisResult:
+    """Blocking part of /analyze-patterns, run on the ML thread pool"""
+    # Fetch comprehensive data
+    budgets_df, spending_df, accounts_df = predictor.fetch_comprehensive_data(
+        request.user_id, 
+        request.historical_months
+    )
+    
+    if budgets_df.empty:
+        return PatternAnalysisResult(
+            analysis={
+                "patterns": {},
+                "message": "No historical data available",
+                "user_id": request.user_id,
+                "ml_enabled": True
+            },
+            user_id=request.user_id,
+            ml_enabled=True
+        )
+    
+    # Engineer features and run analysis
+    features_df = predictor.engineer_features(budgets_df, spending_df, accounts_df)
+    spending_clusters = predictor.classify_spending_behavior(features_df)
+    seasonal_patterns = predictor.detect_seasonal_patterns(features_df)
+    
+    # Build summary
+    analysis_results = {
+        "spending_behavior_clusters": spending_clusters,
+        "seasonal_patterns": seasonal_patterns,
+        "data_quality": {
+            "total_budget_records": len(budgets_df),
+            "total_spending_records": int(spending_df['txn_count'].sum()) if not spending_df.empty else 0,
+            "categories_analyzed": len(features_df['category_id'].unique()) if not features_df.empty else 0,
+            "time_span_months": request.historical_months
+        },
+        "ml_insights": {
+            "clustering_algorithm": "K-Means",
+            "seasonal_detection": "Statistical Peak Analysis",
+            "feature_engineering": "Time series + Financial metrics"
+        }
+    }
+    
+    return PatternAnalysisResult(
+        analysis=analysis_results,
+        user_id=int(request.user_id),
+        ml_enabled=True
+    )
+
 @app.post("/analyze-patterns", response_model=PatternAnalysisResult)
 async def analyze_patterns(request: PatternAnalysisRequest):
     """
@@ -1457,56 +2106,71 @@ async def analyze_patterns(request: PatternAnalysisRequest):
     behavioral clustering, and seasonal trend detection.
     """
     try:
-        # Fetch comprehensive data
-        budgets_df, spending_df, accounts_df = predictor.fetch_comprehensive_data(
-            request.user_id, 
-            request.historical_months
-        )
-        
-        if budgets_df.empty:
-            return PatternAnalysisResult(
-                analysis={
-                    "patterns": {},
-                    "message": "No historical data available",
-                    "user_id": request.user_id,
-                    "ml_enabled": True
-                },
-                user_id=request.user_id,
-                ml_enabled=True
-            )
-        
-        # Engineer features and run analysis
-        features_df = predictor.engineer_features(budgets_df, spending_df, accounts_df)
-        spending_clusters = predictor.classify_spending_behavior(features_df)
-        seasonal_patterns = predictor.detect_seasonal_patterns(features_df)
-        
-        # Build summary
-        analysis_results = {
-            "spending_behavior_clusters": spending_clusters,
-            "seasonal_patterns": seasonal_patterns,
-            "data_quality": {
-                "total_budget_records": len(budgets_df),
-                "total_spending_records": len(spending_df),
-                "categories_analyzed": len(features_df['category_id'].unique()) if not features_df.empty else 0,
-                "time_span_months": request.historical_months
-            },
-            "ml_insights": {
-                "clustering_algorithm": "K-Means",
-                "seasonal_detection": "Statistical Peak Analysis",
-                "feature_engineering": "Time series + Financial metrics"
-            }
-        }
-        
-        return PatternAnalysisResult(
-            analysis=analysis_results,
-            user_id=int(request.user_id),
-            ml_enabled=True
-        )
-        
+        return await run_blocking(_analyze_patterns, request)
     except Exception as e:
         logger.error(f"Pattern analysis error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def _user_insights(request: BudgetPredictionRequest) -> Dict[str, Any]:
+    """Blocking part of /user-insights, run on the ML thread pool"""
+    logger.info(f"User insights request for user {request.user_id}")
+    
+    # Create user profiles and clusters
+    user_clusters = predictor.get_user_clusters(request.historical_months)
+    
+    # Get user's cluster information
+    user_cluster_info = user_clusters.get(request.user_id, {})
+    
+    if not user_cluster_info:
+        return {
+            "user_id": request.user_id,
+            "cluster_id": None,
+            "message": "Insufficient data for user clustering",
+            "peer_recommendations": {}
+        }
+    
+    # Get peer recommendations for user's main categories
+    # Only the budget rows are needed to find them, not the spending and account history
+    budgets_df = predictor.fetch_budget_history(request.user_id, request.historical_months)
+    main_categories = []
+    if not budgets_df.empty:
+        category_ids, first_rows, row_counts = np.unique(
+            budgets_df['category_id'].to_numpy(), return_index=True, return_counts=True
+        )
+        # Most budgeted first; ties keep the order the categories first appear in (latest budgets first)
+        main_categories = category_ids[np.lexsort((first_rows, -row_counts))[:5]].tolist()
+    
+    peer_stats = predictor.get_peer_recommendations_bulk(request.user_id, main_categories, user_clusters)
+    
+    peer_recommendations = {}
+    for category_id in main_categories:
+        peer_data = peer_stats.get(int(category_id))
+        if peer_data:
+            peer_recommendations[int(category_id)] = {
+                "avg_peer_budget": peer_data['avg_peer_budget'] / 100,  # Convert to dollars
+                "avg_peer_spending": peer_data.get('avg_peer_spending', 0) / 100,
+                "peer_count": peer_data['peer_count'],
+                "samples": peer_data['peer_samples']
+            }
+    
+    cluster_profile = user_cluster_info.get('cluster_profile', {})
+    
+    return {
+        "user_id": request.user_id,
+        "cluster_id": user_cluster_info.get('cluster_id'),
+        "cluster_profile": {
+            "user_count": cluster_profile.get('user_count', 0),
+            "avg_monthly_spending": round(cluster_profile.get('avg_monthly_spending', 0) / 100, 2),
+            "avg_expense_ratio": round(cluster_profile.get('avg_expense_ratio', 0), 2),
+            "avg_budget_adherence": round(cluster_profile.get('avg_budget_adherence', 0), 2),
+            "avg_categories": round(cluster_profile.get('avg_categories', 0), 1),
+            "avg_age_months": round(cluster_profile.get('avg_age_months', 0), 1)
+        },
+        "similar_users_count": len(user_cluster_info.get('similarity_peers', [])),
+        "peer_recommendations": peer_recommendations,
+        "insights": predictor._generate_user_insights(user_cluster_info, cluster_profile)
+    }
+
 @app.post("/user-insights")
 async def get_user_insights(request: BudgetPredictionRequest):
     """
@@ -1516,56 +2180,7 @@ async def get_user_insights(request: BudgetPredictionRequest):
     personalized financial insights and peer-based recommendations.
     """
     try:
-        logger.info(f"User insights request for user {request.user_id}")
-        
-        # Create user profiles and clusters
-        user_profiles_df = predictor.create_user_profiles(request.historical_months)
-        user_clusters = predictor.cluster_users(user_profiles_df)
-        
-        # Get user's cluster information
-        user_cluster_info = user_clusters.get(request.user_id, {})
-        
-        if not user_cluster_info:
-            return {
-                "user_id": request.user_id,
-                "cluster_id": None,
-                "message": "Insufficient data for user clustering",
-                "peer_recommendations": {}
-            }
-        
-        # Get peer recommendations for user's main categories
-        budgets_df, spending_df, accounts_df = predictor.fetch_comprehensive_data(request.user_id, request.historical_months)
-        main_categories = budgets_df['category_id'].value_counts().head(5).index.tolist() if not budgets_df.empty else []
-        
-        peer_recommendations = {}
-        for category_id in main_categories:
-            peer_data = predictor.get_peer_recommendations(request.user_id, category_id, user_clusters)
-            if peer_data:
-                peer_recommendations[int(category_id)] = {
-                    "avg_peer_budget": peer_data['avg_peer_budget'] / 100,  # Convert to dollars
-                    "avg_peer_spending": peer_data.get('avg_peer_spending', 0) / 100,
-                    "peer_count": peer_data['peer_count'],
-                    "samples": peer_data['peer_samples']
-                }
-        
-        cluster_profile = user_cluster_info.get('cluster_profile', {})
-        
-        return {
-            "user_id": request.user_id,
-            "cluster_id": user_cluster_info.get('cluster_id'),
-            "cluster_profile": {
-                "user_count": cluster_profile.get('user_count', 0),
-                "avg_monthly_spending": round(cluster_profile.get('avg_monthly_spending', 0) / 100, 2),
-                "avg_expense_ratio": round(cluster_profile.get('avg_expense_ratio', 0), 2),
-                "avg_budget_adherence": round(cluster_profile.get('avg_budget_adherence', 0), 2),
-                "avg_categories": round(cluster_profile.get('avg_categories', 0), 1),
-                "avg_age_months": round(cluster_profile.get('avg_age_months', 0), 1)
-            },
-            "similar_users_count": len(user_cluster_info.get('similarity_peers', [])),
-            "peer_recommendations": peer_recommendations,
-            "insights": predictor._generate_user_insights(user_cluster_info, cluster_profile)
-        }
-        
+        return await run_blocking(_user_insights, request)
     except Exception as e:
         logger.error(f"User insights error: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -5,6 +5,7 @@ import (
 	"encoding/json"
 	"fmt"
 	"io"
+	"log"
 	"net/http"
 	"os"
 	"strconv"
@@ -211,6 +212,35 @@ func GetSpendingPatterns(c *gin.Context) {
 }
 
 // getAIServiceURL returns the AI service URL from environment variables
+// aiInvalidateClient bounds how long a background cache invalidation may wait for the AI service
+var aiInvalidateClient = &http.Client{Timeout: 5 * time.Second}
+
+// invalidateAIPredictions tells the AI service to drop its cached predictions and fetched history
+// for a user after their budgets or transactions changed. It runs in the background and only logs
+// failures, so a slow or unavailable AI service never holds up the write itself.
+func invalidateAIPredictions(userID uint) {
+	go func() {
+		url := fmt.Sprintf("%s/invalidate/%d", getAIServiceURL(), userID)
+		req, err := http.NewRequest(http.MethodPost, url, nil)
+		if err != nil {
+			log.Printf("Error preparing AI cache invalidation: %v", err)
+			return
+		}
+		req.Header.Set("X-Internal-Token", os.Getenv("AI_INTERNAL_TOKEN"))
+
+		resp, err := aiInvalidateClient.Do(req)
+		if err != nil {
+			log.Printf("Error invalidating AI predictions for user %d: %v", userID, err)
+			return
+		}
+		defer resp.Body.Close()
+
+		if resp.StatusCode != http.StatusOK {
+			log.Printf("AI service rejected cache invalidation for user %d: %s", userID, resp.Status)
+		}
+	}()
+}
+
 func getAIServiceURL() string {
 	aiServiceHost := os.Getenv("AI_SERVICE_HOST")
 	if aiServiceHost == "" {
@@ -380,6 +380,7 @@ func CreateBudget(c *gin.Context) {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": "failed to commit budget"})
 		return
 	}
+	invalidateAIPredictions(userID)
 
 	// Reload with relationships
 	db.DB.Preload("Items.Category").First(&budget, budget.ID)
@@ -501,6 +502,7 @@ func UpdateBudget(c *gin.Context) {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": "failed to commit budget update"})
 		return
 	}
+	invalidateAIPredictions(userID)
 
 	// Reload with relationships
 	db.DB.Preload("Items.Category").First(&budget, budget.ID)
@@ -551,6 +553,7 @@ func DeleteBudget(c *gin.Context) {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": "failed to commit budget deletion"})
 		return
 	}
+	invalidateAIPredictions(userID)
 
 	c.JSON(http.StatusOK, gin.H{"message": "budget deleted successfully"})
 }
@@ -337,6 +337,9 @@ func SyncPlaidTransactions(c *gin.Context) {
 	}
 
 	fmt.Printf("📊 Sync Summary: %d transactions added, %d categorized\n", transactionsAdded, categorizedCount)
+	if transactionsAdded > 0 {
+		invalidateAIPredictions(userID)
+	}
 
 	c.JSON(200, gin.H{
 		"success":             true,
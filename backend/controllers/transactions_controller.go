@@ -255,6 +255,7 @@ func CreateTransaction(c *gin.Context) {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": "failed to commit transaction"})
 		return
 	}
+	invalidateAIPredictions(userID)
 
 	// Update account balance
 	if err := UpdateAccountBalance(input.AccountID); err != nil {
@@ -363,6 +364,7 @@ func UpdateTransaction(c *gin.Context) {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": "failed to update transaction"})
 		return
 	}
+	invalidateAIPredictions(userID)
 
 	// Update account balance
 	if err := UpdateAccountBalance(transaction.AccountID); err != nil {
@@ -407,6 +409,7 @@ func DeleteTransaction(c *gin.Context) {
 		c.JSON(http.StatusInternalServerError, gin.H{"error": "failed to delete transaction"})
 		return
 	}
+	invalidateAIPredictions(userID)
 
 	// Update account balance
 	if err := UpdateAccountBalance(accountID); err != nil {
@@ -56,6 +56,8 @@ func ConnectDatabase() {
 				&models.BankConnection{},
 				&models.BankAccount{},
 				&models.BankSyncLog{},
+				&models.MLUserSpendingDaily{},
+				&models.MLUserSpendingDailyState{},
 			); err != nil {
 				log.Fatalf("❌ Failed to migrate database: %v", err)
 			}
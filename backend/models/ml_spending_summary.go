@@ -0,0 +1,32 @@
+package models
+
+import "time"
+
+// MLUserSpendingDaily holds daily per-user/category transaction totals. The AI service rebuilds
+// it in the background and reads it for peer clustering; the backend only migrates the table.
+type MLUserSpendingDaily struct {
+	UserID         int64     `gorm:"not null;index:ml_user_spending_daily_user_date,priority:1" json:"user_id"`
+	CategoryID     *int64    `json:"category_id"`
+	TxnDate        time.Time `gorm:"type:date;not null;index:ml_user_spending_daily_user_date,priority:2" json:"txn_date"`
+	ExpenseCount   int64     `gorm:"not null" json:"expense_count"`
+	ExpenseCents   int64     `gorm:"type:numeric;not null" json:"expense_cents"`
+	ExpenseSquares int64     `gorm:"type:numeric;not null" json:"expense_squares"`
+	IncomeCents    int64     `gorm:"type:numeric;not null" json:"income_cents"`
+	TxnCount       int64     `gorm:"not null" json:"txn_count"`
+}
+
+func (MLUserSpendingDaily) TableName() string {
+	return "ml_user_spending_daily"
+}
+
+// MLUserSpendingDailyState is the single row recording when the AI service last rebuilt
+// ml_user_spending_daily and a fingerprint of the transactions it was built from
+type MLUserSpendingDailyState struct {
+	ID            int16     `gorm:"primaryKey;autoIncrement:false" json:"id"`
+	RefreshedAt   time.Time `gorm:"type:timestamptz;not null" json:"refreshed_at"`
+	SourceVersion string    `gorm:"type:text;not null" json:"source_version"`
+}
+
+func (MLUserSpendingDailyState) TableName() string {
+	return "ml_user_spending_daily_state"
+}
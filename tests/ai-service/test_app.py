@@ -0,0 +1,251 @@
+"""
+Tests for the AI budget prediction service
+
+The database is replaced by stubs, so these run without PostgreSQL:
+    python -m unittest discover -s tests/ai-service
+"""
+
+import json
+import os
+import sys
+import unittest
+from contextlib import contextmanager
+from datetime import date
+from unittest import mock
+
+import pandas as pd
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'ai-service'))
+
+import app as service
+
+
+class FakeCursor:
+    """Cursor whose every query returns the same single row"""
+    
+    def __init__(self, row):
+        self.row = row
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        return False
+    
+    def execute(self, query, params=None):
+        pass
+    
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def __init__(self, row):
+        self.row = row
+        self.autocommit = True
+    
+    def cursor(self):
+        return FakeCursor(self.row)
+    
+    def commit(self):
+        pass
+    
+    def rollback(self):
+        pass
+
+
+class UserClusterCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.predictor = service.AdvancedBudgetPredictor()
+        self.predictor.model_store_dir = ''
+        # Every lookup is past the refresh interval, so each one re-checks the data version
+        self.predictor.cluster_refresh_seconds = 0
+        self.data_version = ('2025-01-01', 100, 42)
+        self.builds = 0
+        
+        @contextmanager
+        def fake_connection():
+            yield FakeConnection(self.data_version)
+        
+        def fake_build(historical_months):
+            self.builds += 1
+            return {1: {'cluster_id': self.builds}}
+        
+        for patcher in [
+            mock.patch.object(self.predictor, 'get_db_connection', fake_connection),
+            mock.patch.object(self.predictor, '_build_user_clusters', fake_build),
+            mock.patch.dict(os.environ, {'SPENDING_SUMMARY_REFRESH': '0'}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def test_unchanged_data_reuses_clusters_across_refreshes(self):
+        first = self.predictor.get_user_clusters(18)
+        for _ in range(3):
+            self.predictor.refresh_spending_summary()
+            self.assertIs(self.predictor.get_user_clusters(18), first)
+        self.assertEqual(self.builds, 1)
+    
+    def test_changed_data_rebuilds_clusters(self):
+        self.predictor.get_user_clusters(18)
+        self.data_version = ('2025-01-01', 101, 42)
+        self.assertEqual(self.predictor.get_user_clusters(18), {1: {'cluster_id': 2}})
+        self.assertEqual(self.builds, 2)
+    
+    def test_unreadable_version_is_throttled_by_refresh_interval(self):
+        @contextmanager
+        def failing_connection():
+            raise RuntimeError("relation ml_user_spending_daily_state does not exist")
+            yield
+        
+        self.predictor.cluster_refresh_seconds = 3600
+        with mock.patch.object(self.predictor, 'get_db_connection', failing_connection):
+            first = self.predictor.get_user_clusters(18)
+            self.assertIs(self.predictor.get_user_clusters(18), first)
+        self.assertEqual(self.builds, 1)
+    
+    def test_unreadable_version_keeps_previous_clusters(self):
+        first = self.predictor.get_user_clusters(18)
+        
+        @contextmanager
+        def failing_connection():
+            raise RuntimeError("connection pool exhausted")
+            yield
+        
+        with mock.patch.object(self.predictor, 'get_db_connection', failing_connection):
+            self.assertIs(self.predictor.get_user_clusters(18), first)
+        self.assertEqual(self.builds, 1)
+    
+    def test_force_rebuilds_clusters(self):
+        self.predictor.get_user_clusters(18)
+        self.predictor.get_user_clusters(18, force=True)
+        self.assertEqual(self.builds, 2)
+
+
+class PredictBudgetEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(service.app)
+        self.request = {'user_id': 7, 'target_month': 3, 'target_year': 2025, 'historical_months': 18}
+        self.cache_key = (7, 3, 2025, 18)
+        service.prediction_cache.discard_where(lambda key: key == self.cache_key)
+        self.addCleanup(service.prediction_cache.discard_where, lambda key: key == self.cache_key)
+    
+    def test_empty_predictions_are_not_cached(self):
+        # The fetches return empty frames when the database is down, so "no data" must not stick
+        with mock.patch.object(service.predictor, 'predict_with_ml', return_value=service.PredictionBatch()):
+            response = self.client.post('/predict-budget', json=self.request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['predictions'], [])
+        self.assertIsNone(service.prediction_cache.get(self.cache_key))
+
+
+def make_history(months: int = 8):
+    """Budgets, daily spending and account usage frames as fetch_comprehensive_data returns them"""
+    budgets, spending = [], []
+    for index in range(months):
+        period_start = date(2024, index + 1, 1)
+        for category_id, planned_cents in [(1, 40000), (2, 15000)]:
+            budgets.append({
+                'budget_id': index + 1, 'period_start': period_start, 'period_end': period_start.replace(day=28),
+                'category_id': category_id, 'category_name': f"Category {category_id}", 'category_kind': 'expense',
+                'planned_cents': planned_cents + 1000 * (index % 3) * category_id, 'month': period_start.month,
+                'year': period_start.year, 'day_of_week': period_start.weekday(),
+                'quarter': (period_start.month - 1) // 3 + 1, 'timestamp_epoch': float(index)
+            })
+            spending.append({
+                'category_id': category_id, 'txn_date': period_start.replace(day=10),
+                'spent_cents': planned_cents - 2000, 'txn_count': 3,
+                'spent_deviation': 0.0, 'spent_squared_deviation': 0.0
+            })
+    accounts = [{
+        'account_id': 1, 'account_name': 'Checking', 'account_type': 'checking', 'category_id': category_id,
+        'transaction_count': 12, 'avg_transaction_amount': 55.0
+    } for category_id in (1, 2)]
+    budgets_df = pd.DataFrame(budgets).sort_values('period_start', ascending=False, kind='mergesort').reset_index(drop=True)
+    return budgets_df, pd.DataFrame(spending), pd.DataFrame(accounts)
+
+
+class AnalyzePatternsEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(service.app)
+    
+    def test_analyze_patterns_returns_json(self):
+        with mock.patch.object(service.predictor, 'fetch_comprehensive_data', return_value=make_history()):
+            response = self.client.post('/analyze-patterns', json={'user_id': 7, 'historical_months': 18})
+        self.assertEqual(response.status_code, 200)
+        analysis = response.json()['analysis']
+        self.assertEqual(set(analysis['seasonal_patterns']), {'1', '2'})
+        self.assertEqual(set(analysis['spending_behavior_clusters']), {'1', '2'})
+        self.assertEqual(analysis['data_quality']['categories_analyzed'], 2)
+    
+    def test_seasonal_patterns_use_plain_python_keys(self):
+        budgets_df, spending_df, accounts_df = make_history()
+        features_df = service.predictor.engineer_features(budgets_df, spending_df, accounts_df)
+        patterns = service.predictor.detect_seasonal_patterns(features_df)
+        self.assertTrue(patterns)
+        self.assertTrue(all(type(category_id) is int for category_id in patterns))
+
+
+class RefreshClustersEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(service.app)
+        patcher = mock.patch.object(service.predictor, 'get_user_clusters', return_value={1: {}})
+        self.get_user_clusters = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_requires_internal_token(self):
+        with mock.patch.dict(os.environ, {'AI_INTERNAL_TOKEN': 'secret'}):
+            self.assertEqual(self.client.post('/refresh-clusters').status_code, 403)
+            wrong = self.client.post('/refresh-clusters', headers={'X-Internal-Token': 'guess'})
+            self.assertEqual(wrong.status_code, 403)
+        self.get_user_clusters.assert_not_called()
+    
+    def test_disabled_without_configured_token(self):
+        with mock.patch.dict(os.environ, {'AI_INTERNAL_TOKEN': ''}):
+            response = self.client.post('/refresh-clusters', headers={'X-Internal-Token': ''})
+        self.assertEqual(response.status_code, 403)
+    
+    def test_validates_historical_months(self):
+        with mock.patch.dict(os.environ, {'AI_INTERNAL_TOKEN': 'secret'}):
+            for months in (0, -3, 61, 100000):
+                response = self.client.post('/refresh-clusters', params={'historical_months': months},
+                                            headers={'X-Internal-Token': 'secret'})
+                self.assertEqual(response.status_code, 422)
+            response = self.client.post('/refresh-clusters', params={'historical_months': 12},
+                                        headers={'X-Internal-Token': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.get_user_clusters.assert_called_once_with(12, True)
+
+
+class InvalidateEndpointTest(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(service.app)
+        self.cache_key = (9, 1, 2025, 18)
+        service.prediction_cache.set(self.cache_key, b'{}')
+        self.addCleanup(service.prediction_cache.discard_where, lambda key: key == self.cache_key)
+    
+    def test_rejects_calls_without_token(self):
+        with mock.patch.dict(os.environ, {'AI_INTERNAL_TOKEN': 'secret'}):
+            self.assertEqual(self.client.post('/invalidate/9').status_code, 403)
+        self.assertIsNotNone(service.prediction_cache.get(self.cache_key))
+    
+    def test_drops_cached_predictions_with_token(self):
+        with mock.patch.dict(os.environ, {'AI_INTERNAL_TOKEN': 'secret'}):
+            response = self.client.post('/invalidate/9', headers={'X-Internal-Token': 'secret'})
+        self.assertEqual(response.json(), {'user_id': 9, 'invalidated': 1})
+        self.assertIsNone(service.prediction_cache.get(self.cache_key))
+
+
+class FastJSONResponseTest(unittest.TestCase):
+    def test_non_finite_floats_become_null(self):
+        response = service.FastJSONResponse({'a': float('nan'), 'b': [float('inf'), -float('inf'), 1.5]})
+        self.assertEqual(json.loads(response.body), {'a': None, 'b': [None, None, 1.5]})
+    
+    def test_strings_mentioning_nan_are_kept(self):
+        content = {'category_name': 'NaNa Infinity Cafe', 'amount': 12.5}
+        self.assertEqual(json.loads(service.FastJSONResponse(content).body), content)
+
+
+if __name__ == '__main__':
+    unittest.main()